@@ -0,0 +1,157 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Compares the gevent socket loop (MinecraftSocket + iter_read) with the
+# asyncio adapter (fastmc.aio.MinecraftProtocol). A server process sends
+# a fixed number of PLAY packets to every connection and closes it.
+#
+#   python benchmarks/bench_asyncio.py [<connections> [<concurrency>]]
+
+import sys
+import time
+import socket
+import threading
+import multiprocessing
+
+import fastmc.proto
+from fastmc.proto import Endpoint, WriteBuffer, PLAY
+
+PROTOCOL_VERSION = 47
+
+def make_stream(num_packets):
+    writer = Endpoint.to_client(PROTOCOL_VERSION)
+    writer.switch_state(PLAY)
+    out = WriteBuffer()
+    for n in xrange(num_packets):
+        writer.write(out, 0x15, eid=n, dx=1, dy=0, dz=-1, on_ground=True)
+    return out.getvalue()
+
+def blast_server(listener, stream):
+    def handle(sock):
+        try:
+            sock.sendall(stream)
+        finally:
+            sock.close()
+    while 1:
+        sock, addr = listener.accept()
+        t = threading.Thread(target=handle, args=(sock,))
+        t.daemon = True
+        t.start()
+
+def start_server(stream):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1024)
+    proc = multiprocessing.Process(target=blast_server, args=(listener, stream))
+    proc.daemon = True
+    proc.start()
+    return proc, listener.getsockname()
+
+def run_gevent(addr, connections, concurrency):
+    import gevent.pool
+    import gevent.socket
+
+    received = [0]
+    def client():
+        sock = fastmc.proto.MinecraftSocket(gevent.socket.create_connection(addr))
+        reader = Endpoint.from_server(PROTOCOL_VERSION)
+        reader.switch_state(PLAY)
+        in_buf = fastmc.proto.ByteArrayReadBuffer()
+        while sock.recv_into(in_buf, reader.bytes_needed()):
+            for pkt in reader.iter_read(in_buf):
+                received[0] += 1
+        sock.close()
+
+    pool = gevent.pool.Pool(concurrency)
+    for n in xrange(connections):
+        pool.spawn(client)
+    pool.join()
+    return received[0]
+
+def run_asyncio(addr, connections, concurrency):
+    import fastmc.aio
+    asyncio = fastmc.aio.asyncio
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    received = [0]
+    pending = [connections]
+    running = [0]
+    done = asyncio.Future(loop=loop)
+
+    def on_packet(proto, pkt):
+        received[0] += 1
+
+    def on_close(proto, exc):
+        running[0] -= 1
+        start_more()
+
+    def make_protocol():
+        proto = fastmc.aio.MinecraftProtocol.client(PROTOCOL_VERSION,
+            on_packet=on_packet, on_close=on_close, loop=loop)
+        proto.reader.switch_state(PLAY)
+        return proto
+
+    def start_more():
+        while pending[0] and running[0] < concurrency:
+            pending[0] -= 1
+            running[0] += 1
+            asyncio.ensure_future(loop.create_connection(make_protocol, *addr), loop=loop)
+        if not pending[0] and not running[0] and not done.done():
+            done.set_result(None)
+
+    start_more()
+    loop.run_until_complete(done)
+    loop.close()
+    return received[0]
+
+def bench(name, runner, addr, connections, concurrency):
+    start = time.time()
+    received = runner(addr, connections, concurrency)
+    elapsed = time.time() - start
+    print "%-8s %6d conns %8d pkts %7.2fs %8.0f conns/s %10.0f pkts/s" % (
+        name, connections, received, elapsed,
+        connections / elapsed, received / elapsed)
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    for label, num_packets, conns in (
+        ("connections/sec (10 packets per connection)", 10, connections),
+        ("packets/sec (100000 packets per connection)", 100000, max(1, connections / 200)),
+    ):
+        print label
+        server, addr = start_server(make_stream(num_packets))
+        for name, runner in (("gevent", run_gevent), ("asyncio", run_asyncio)):
+            bench(name, runner, addr, conns, concurrency)
+        server.terminate()
+        print
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Measures AES-CFB8 throughput of every available cipher backend for
+# encrypt, decrypt and in-place decrypt_into on a receive sized buffer.
+#
+#   python benchmarks/bench_cipher.py [<megabytes> [<chunk size>]]
+
+import os
+import sys
+import time
+import warnings
+
+import fastmc.cipher
+
+def bench_op(op, chunks):
+    start = time.time()
+    for chunk in chunks:
+        op(chunk)
+    return time.time() - start
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    warnings.simplefilter("ignore")
+
+    secret = os.urandom(16)
+    total = megabytes * 1024 * 1024
+    data = os.urandom(chunk_size)
+    chunks = [data] * (total / chunk_size)
+    arena = bytearray(data)
+    views = [memoryview(arena)] * len(chunks)
+
+    print "%d MB in %d byte chunks" % (megabytes, chunk_size)
+    for name in fastmc.cipher.available_backends():
+        results = []
+        for op, work in (
+            ("encrypt", chunks),
+            ("decrypt", chunks),
+            ("decrypt_into", views),
+        ):
+            cipher = fastmc.cipher.new_cipher(secret, name)
+            elapsed = bench_op(getattr(cipher, op), work)
+            results.append("%s %7.1f MB/s" % (op, megabytes / elapsed))
+        print "%-14s %s" % (name, ", ".join(results))
+
+if __name__ == "__main__":
+    main()
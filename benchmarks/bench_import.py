@@ -0,0 +1,108 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Startup time of fastmc with the on disk code cache (fastmc.codecache)
+# disabled, cold (empty cache directory), warm and, if they exist, with
+# the modules generated by fastmc.aot (python -m fastmc.aot 47). Every
+# run uses a fresh interpreter, imports fastmc.proto (which imports the
+# whole package) and then builds protocol 47 as a client would.
+# Protocols are built lazily, so the import itself doesn't generate
+# packet code. Reports best and median times and the median peak RSS.
+#
+#   python benchmarks/bench_import.py [<runs>]
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+import fastmc.proto
+
+CHILD = """
+import time, resource
+start = time.time()
+import fastmc.proto
+imported = time.time()
+fastmc.proto.Endpoint.client_pair(47)
+built = time.time()
+print imported - start, built - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+def run_child(env):
+    output = subprocess.check_output([sys.executable, "-W", "ignore", "-c", CHILD], env=env)
+    imported, built, rss = output.split()[-3:]
+    return float(imported), float(built), int(rss)
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    cache_dir = tempfile.mkdtemp(prefix="fastmc-bench-import-")
+    base_env = dict(os.environ, FASTMC_CODE_CACHE=cache_dir, FASTMC_NO_GENERATED="1")
+    base_env.pop("FASTMC_NO_CODE_CACHE", None)
+
+    def disabled():
+        return dict(base_env, FASTMC_NO_CODE_CACHE="1")
+    def cold():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        return base_env
+    def warm():
+        return base_env
+    def generated():
+        env = dict(base_env, FASTMC_NO_CODE_CACHE="1")
+        del env["FASTMC_NO_GENERATED"]
+        return env
+
+    # variants take turns, so they are affected alike by changing load
+    variants = [("no cache", disabled), ("cold", cold), ("warm", warm)]
+    if fastmc.proto.load_generated(47, fastmc.proto.protocol(47).definitions()):
+        variants.append(("generated", generated))
+    else:
+        print "no generated module for protocol 47, skipping that variant"
+    results = dict((name, []) for name, setup in variants)
+    try:
+        for run in xrange(runs):
+            for name, setup in variants:
+                results[name].append(run_child(setup()))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print "%d runs, import fastmc.proto / import and build protocol 47" % runs
+    print "%-10s %10s %10s %10s %10s %10s" % ("", "best", "median", "best", "median", "max rss")
+    for name, setup in variants:
+        imports = [imported for imported, built, rss in results[name]]
+        builds = [built for imported, built, rss in results[name]]
+        print "%-10s %8.1fms %8.1fms %8.1fms %8.1fms %8dkB" % (name,
+            min(imports) * 1000, median(imports) * 1000,
+            min(builds) * 1000, median(builds) * 1000,
+            median([rss for imported, built, rss in results[name]]))
+
+if __name__ == "__main__":
+    main()
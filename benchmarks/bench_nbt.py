@@ -0,0 +1,226 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Measures decoding and encoding of item NBT as found in slots: an
+# enchanted book, a written book, an enchanted and renamed sword, a
+# firework rocket and a player head. Also decodes and encodes a full
+# 1.8 WindowItems slot array of a player inventory holding these items
+# and tags with large arrays as found in map data and chunk tile
+# entities. Set FASTMC_NBT_NUMPY to measure numpy backed arrays.
+#
+#   python benchmarks/bench_nbt.py [<iterations>]
+
+import sys
+import time
+from array import array
+from cStringIO import StringIO
+
+from fastmc.proto import (
+    NBT, NbtTag, NbtList, Slot, read_nbt, write_nbt,
+    read_slot_array_1_8, write_slot_array_1_8,
+)
+
+REPEAT = 5
+
+def tag(tag_type, value):
+    return NbtTag(tag_type, value)
+
+def compound(**values):
+    return tag(NbtTag.COMPOUND, values)
+
+def short(value):
+    return tag(NbtTag.SHORT, value)
+
+def string(value):
+    return tag(NbtTag.STRING, value)
+
+def nbt_list(tag_type, values):
+    return tag(NbtTag.LIST, NbtList(tag_type, values))
+
+def make_items():
+    enchanted_book = compound(
+        StoredEnchantments=nbt_list(NbtTag.COMPOUND, [
+            {"id": short(16), "lvl": short(5)},
+            {"id": short(20), "lvl": short(2)},
+            {"id": short(34), "lvl": short(3)},
+        ]),
+        RepairCost=tag(NbtTag.INT, 7),
+    )
+    pages = [
+        u'{"text":"%s"}' % (u"Page %d of a written book with some text on it. " % n * 4)
+        for n in xrange(12)
+    ]
+    written_book = compound(
+        title=string(u"A written book"),
+        author=string(u"dividuum"),
+        generation=tag(NbtTag.INT, 0),
+        resolved=tag(NbtTag.BYTE, 1),
+        pages=nbt_list(NbtTag.STRING, pages),
+    )
+    sword = compound(
+        ench=nbt_list(NbtTag.COMPOUND, [
+            {"id": short(16), "lvl": short(5)},
+            {"id": short(19), "lvl": short(2)},
+            {"id": short(20), "lvl": short(2)},
+            {"id": short(34), "lvl": short(3)},
+        ]),
+        display=compound(
+            Name=string(u"Sword of Benchmarking"),
+            Lore=nbt_list(NbtTag.STRING, [u"Measures things", u"very quickly"]),
+        ),
+        RepairCost=tag(NbtTag.INT, 3),
+    )
+    firework = compound(
+        Fireworks=compound(
+            Flight=tag(NbtTag.BYTE, 2),
+            Explosions=nbt_list(NbtTag.COMPOUND, [
+                {
+                    "Type": tag(NbtTag.BYTE, n % 5),
+                    "Flicker": tag(NbtTag.BYTE, 1),
+                    "Trail": tag(NbtTag.BYTE, 0),
+                    "Colors": tag(NbtTag.INT_ARRAY, [0xff0000, 0x00ff00, 0x0000ff]),
+                    "FadeColors": tag(NbtTag.INT_ARRAY, [0xffffff]),
+                } for n in xrange(3)
+            ]),
+        ),
+    )
+    head = compound(
+        SkullOwner=compound(
+            Id=string(u"c06f8906-4c8a-4911-9c29-ea1dbd1aab82"),
+            Name=string(u"dividuum"),
+            Properties=compound(
+                textures=nbt_list(NbtTag.COMPOUND, [{
+                    "Value": string(u"eyJ0ZXh0dXJlcyI6eyJTS0lOIjp7InVybCI6Imh0dHA6Ly90ZXh0dXJl" * 4),
+                    "Signature": string(u"c2lnbmF0dXJl" * 40),
+                }]),
+            ),
+        ),
+    )
+    return [
+        ("enchanted book", 403, enchanted_book),
+        ("written book", 387, written_book),
+        ("enchanted sword", 276, sword),
+        ("firework rocket", 401, firework),
+        ("player head", 397, head),
+    ]
+
+def make_arrays():
+    map_data = compound(
+        scale=tag(NbtTag.BYTE, 0),
+        dimension=tag(NbtTag.BYTE, 0),
+        width=short(128),
+        height=short(128),
+        xCenter=tag(NbtTag.INT, 0),
+        zCenter=tag(NbtTag.INT, 0),
+        colors=tag(NbtTag.BYTE_ARRAY, array('b', [n % 128 for n in xrange(128 * 128)])),
+    )
+    section = compound(
+        Y=tag(NbtTag.BYTE, 4),
+        Blocks=tag(NbtTag.BYTE_ARRAY, array('b', [n % 7 for n in xrange(4096)])),
+        Data=tag(NbtTag.BYTE_ARRAY, array('b', [0] * 2048)),
+        BlockLight=tag(NbtTag.BYTE_ARRAY, array('b', [0] * 2048)),
+        SkyLight=tag(NbtTag.BYTE_ARRAY, array('b', [-1] * 2048)),
+    )
+    chunk = compound(
+        Level=compound(
+            xPos=tag(NbtTag.INT, 10),
+            zPos=tag(NbtTag.INT, -3),
+            HeightMap=tag(NbtTag.INT_ARRAY, array('i', [64 + n % 8 for n in xrange(256)])),
+            Biomes=tag(NbtTag.BYTE_ARRAY, array('b', [1] * 256)),
+            Sections=nbt_list(NbtTag.COMPOUND, [section.value] * 8),
+        ),
+    )
+    int_array = compound(
+        values=tag(NbtTag.INT_ARRAY, array('i', [n * 65537 - (1 << 30) for n in xrange(16384)])),
+    )
+    return [
+        ("map data", map_data),
+        ("chunk", chunk),
+        ("int array 16384", int_array),
+    ]
+
+def encode(writer, value):
+    out = StringIO()
+    writer(out, value)
+    return out.getvalue()
+
+def plain(value):
+    # array tags as lists, so numpy arrays can be compared
+    if isinstance(value, dict):
+        return dict((key, plain(item)) for key, item in value.iteritems())
+    if isinstance(value, (tuple, list)):
+        return [plain(item) for item in value]
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value
+
+def measure(op, iterations):
+    # best of REPEAT runs
+    best = None
+    for r in xrange(REPEAT):
+        start = time.time()
+        for n in xrange(iterations):
+            op()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / iterations
+
+def bench(name, reader, writer, value, iterations):
+    data = encode(writer, value)
+    decoded = reader(StringIO(data))
+    assert plain(reader(StringIO(encode(writer, decoded)))) == plain(decoded)
+    read_time = measure(lambda: reader(StringIO(data)), iterations)
+    write_time = measure(lambda: writer(StringIO(), value), iterations)
+    print "%-20s %6d %8.2fus %8.2fus" % (name, len(data), read_time * 1e6, write_time * 1e6)
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    items = make_items()
+
+    print "%d iterations" % iterations
+    print "%-20s %6s %10s %10s" % ("", "bytes", "read", "write")
+    for name, item_id, root in items:
+        bench(name, read_nbt, write_nbt, NBT('', root), iterations)
+
+    # player inventory: 45 slots, some empty, some plain
+    slots = []
+    for n in xrange(45):
+        if n % 3 == 0:
+            slots.append(None)
+        elif n % 3 == 1:
+            slots.append(Slot(1, 64, 0, None))
+        else:
+            name, item_id, root = items[n % len(items)]
+            slots.append(Slot(item_id, 1, 0, root))
+    bench("window items", read_slot_array_1_8, write_slot_array_1_8, slots, iterations / 10)
+
+    for name, root in make_arrays():
+        bench(name, read_nbt, write_nbt, NBT('', root), iterations / 10)
+
+if __name__ == "__main__":
+    main()
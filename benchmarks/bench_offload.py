@@ -0,0 +1,110 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Measures how long the gevent hub is stalled while several greenlets
+# compress and decompress large chunk-sized frames, once inline and once
+# with fastmc.offload.ZlibOffload. A ticker greenlet sleeps in short
+# intervals and records how late it wakes up. Also reports the CPU time
+# per compressed frame recorded by the policy, which should be about the
+# same for both.
+#
+#   python benchmarks/bench_offload.py [<frames> [<frame size>]]
+
+import os
+import sys
+import time
+
+import gevent
+import gevent.pool
+
+from fastmc.proto import WriteBuffer, CompressionPolicy, write_frame, decode_frame, write_varint
+from fastmc.offload import ZlibOffload
+
+THRESHOLD = 256
+TICK = 0.001
+
+def make_chunk_payload(size):
+    # packet id of ChunkData followed by half random, half constant data,
+    # roughly as compressible as real chunk sections
+    out = WriteBuffer()
+    write_varint(out, 0x21)
+    out.write(os.urandom(size / 2))
+    out.write("\x00" * (size - size / 2))
+    return out.getvalue()
+
+def ticker(lateness, running):
+    while running[0]:
+        start = time.time()
+        gevent.sleep(TICK)
+        lateness.append(time.time() - start - TICK)
+
+def worker(policy, payload, frames):
+    for n in xrange(frames):
+        out = WriteBuffer()
+        write_frame(out, payload, THRESHOLD, policy)
+        frame = out.getvalue()
+        # skip the frame length prefix, decode_frame expects the frame body
+        offset = 0
+        while ord(frame[offset]) & 0x80:
+            offset += 1
+        body = decode_frame(frame[offset + 1:], THRESHOLD, policy)
+        assert len(body.getvalue()) == len(payload)
+
+def bench(name, policy, payload, frames, concurrency):
+    lateness = []
+    running = [True]
+    tick = gevent.spawn(ticker, lateness, running)
+    pool = gevent.pool.Pool(concurrency)
+    start = time.time()
+    for n in xrange(concurrency):
+        pool.spawn(worker, policy, payload, frames / concurrency)
+    pool.join()
+    elapsed = time.time() - start
+    running[0] = False
+    tick.join()
+    lateness = lateness or [0.0]
+    stats = policy.stats()[0x21]
+    print "%-8s %7.2fs %6d ticks, hub latency avg %7.2fms max %7.2fms, cpu %6.2fms/frame" % (
+        name, elapsed, len(lateness),
+        sum(lateness) / len(lateness) * 1000, max(lateness) * 1000,
+        stats.cpu_time / stats.count * 1000)
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024 * 1024
+    concurrency = 8
+
+    payload = make_chunk_payload(size)
+    print "%d frames of %d bytes, %d greenlets" % (frames, size, concurrency)
+    for name, policy in (
+        ("inline", CompressionPolicy()),
+        ("offload", ZlibOffload(threads=4)),
+    ):
+        bench(name, policy, payload, frames, concurrency)
+
+if __name__ == "__main__":
+    main()
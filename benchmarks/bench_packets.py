@@ -0,0 +1,190 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Parses and emits every PLAY packet of protocol 47 (both directions)
+# with sample field values. Reports the average time per packet and the
+# geometric mean of the per packet speedups relative to the first
+# variant. Each codegen variant runs in its own process, as the
+# generated code is selected with environment variables at import time.
+# The parse_from variant uses the offset based parsers instead of parse.
+# Emitting includes the frame header. The emit_into variant writes
+# frames directly into a ByteArrayWriteBuffer.
+#
+#   python benchmarks/bench_packets.py [<iterations>]
+
+import os
+import sys
+import math
+import time
+import subprocess
+from cStringIO import StringIO
+
+VARIANTS = [
+    ("no inline varint", {"FASTMC_NO_INLINE_VARINT": "1"}),
+    ("inline varint", {}),
+    ("parse_from", {"BENCH_PACKETS_PARSE_FROM": "1"}),
+    ("emit_into", {"BENCH_PACKETS_PARSE_FROM": "1", "BENCH_PACKETS_EMIT_INTO": "1"}),
+]
+
+PROTOCOL_VERSION = 47
+
+def make_samples():
+    from fastmc import proto
+    one_chunk = "\x00" * (16*16*16 * 2 + 16*16*16 / 2 * 2 + 16*16)
+    return {
+        'bool':             True,
+        'byte':             -5,
+        'ubyte':            200,
+        'short':            -300,
+        'ushort':           60000,
+        'int':              123456,
+        'long':             1 << 40,
+        'float':            1.5,
+        'double':           2.25,
+        'int8':             1.5,
+        'int32':            10.5,
+        'byte32':           1.5,
+        'varint':           300,
+        'string':           u"fastmc",
+        'json':             {"text": "fastmc"},
+        'bytes_exhaustive': "payload",
+        'short_byte_array': "abc",
+        'varint_byte_array': "abc",
+        'position_packed':  proto.Position(10, 64, -20),
+        'uuid':             0x0123456789abcdef0123456789abcdef,
+        'slot_1_8':         proto.Slot(1, 2, 3, None),
+        'slot_array_1_8':   [proto.Slot(1, 2, 3, None), None],
+        'metadata':         {0: (0, 1), 1: (1, 300), 2: (4, u"name")},
+        'metadata_1_8':     {0: (0, 1), 1: (1, 300), 2: (4, u"name")},
+        'nbt':              proto.NBT('', proto.NbtTag(proto.NbtTag.COMPOUND, {})),
+        'objdata':          proto.ObjectData(1, proto.SpeedVector(1, 2, 3)),
+        'explosions':       [proto.ExplosionRecord(1, 2, 3)],
+        'list_actions':     proto.PlayerListActions(proto.LIST_ACTION_UPDATE_LATENCY,
+                                [proto.PlayerListActionLatency(1, 50)]),
+        'map_chunk_bulk_14w28a': proto.ChunkBulk14w28a(True, one_chunk,
+                                [proto.Chunk14w28a(0, 0, 1, 0)]),
+        'map_icons':        [proto.MapIcon(1, 2, 3, 4)],
+        'property_array_14w04a': {"generic.movementSpeed": proto.Property(0.1, [])},
+        'statistic_array':  [(u"stat.leaveGame", 1)],
+        'varint_string_array': [u"fastmc"],
+        'varint_varint_array': [1, 300],
+        'changes_14w26c':   [proto.BlockChange(1, 2, 3, 4)],
+    }
+
+def sample_packets():
+    from fastmc import proto
+    samples = make_samples()
+    protocol = proto.protocol(PROTOCOL_VERSION)
+    for side in (proto.CLIENTBOUND, proto.SERVERBOUND):
+        for pkt_id, packet in sorted(protocol.get_packets(proto.PLAY, side).iteritems()):
+            pkt = packet.create(**dict(
+                (name, samples[parser]) for name, parser, condition in packet._fields
+            ))
+            out = StringIO()
+            pkt.emit(out)
+            yield packet, pkt, out.getvalue()
+
+REPEAT = 5
+ROUNDS = 3
+
+def measure(loop, iterations):
+    # best of REPEAT runs
+    best = None
+    for r in xrange(REPEAT):
+        start = time.time()
+        loop(iterations)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / iterations
+
+def run(iterations):
+    from fastmc.proto import write_packet, ByteArrayWriteBuffer
+    use_parse_from = bool(os.getenv("BENCH_PACKETS_PARSE_FROM"))
+    use_emit_into = bool(os.getenv("BENCH_PACKETS_EMIT_INTO"))
+    for packet, pkt, data in sample_packets():
+        parse, parse_from = packet.parse, packet.parse_from
+        def parse_loop(iterations):
+            for n in xrange(iterations):
+                parse(StringIO(data))
+        def parse_from_loop(iterations):
+            for n in xrange(iterations):
+                parse_from(data, 0)
+        # emitting includes the frame header, written to a new
+        # StringIO or a reused ByteArrayWriteBuffer
+        def emit_loop(iterations):
+            for n in xrange(iterations):
+                write_packet(StringIO(), pkt, None)
+        def emit_into_loop(iterations):
+            out = ByteArrayWriteBuffer()
+            clear, write_into = out.clear, out.write_packet
+            for n in xrange(iterations):
+                clear()
+                write_into(pkt, None)
+        parse_time = measure(parse_from_loop if use_parse_from else parse_loop, iterations)
+        emit_time = measure(emit_into_loop if use_emit_into else emit_loop, iterations)
+        print "%s %.9f %.9f" % (packet.__name__, parse_time, emit_time)
+
+def geo_mean(values):
+    return math.exp(sum(math.log(v) for v in values) / len(values))
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    if os.getenv("BENCH_PACKETS_CHILD"):
+        run(iterations)
+        return
+
+    # variants take turns, so they are affected alike by changing load
+    results = {}
+    for round in xrange(ROUNDS):
+        for name, variant_env in VARIANTS:
+            env = dict(os.environ, BENCH_PACKETS_CHILD="1", **variant_env)
+            output = subprocess.check_output([sys.executable, __file__, str(iterations)], env=env)
+            times = [
+                (float(parse_time), float(emit_time))
+                for pkt_name, parse_time, emit_time in (line.split() for line in output.splitlines())
+            ]
+            if name in results:
+                times = [(min(a[0], b[0]), min(a[1], b[1])) for a, b in zip(results[name], times)]
+            results[name] = times
+
+    print "protocol %d PLAY packets, %d iterations" % (PROTOCOL_VERSION, iterations)
+    print "%-20s %17s %17s" % ("", "parse avg/speedup", "emit avg/speedup")
+    baseline = None
+    for name, variant_env in VARIANTS:
+        times = results[name]
+        if baseline is None:
+            baseline = times
+        parse_speedup = geo_mean([b[0] / t[0] for b, t in zip(baseline, times)])
+        emit_speedup = geo_mean([b[1] / t[1] for b, t in zip(baseline, times)])
+        print "%-20s %8.2fus %5.2fx %8.2fus %5.2fx" % (
+            name,
+            sum(t[0] for t in times) / len(times) * 1e6, parse_speedup,
+            sum(t[1] for t in times) / len(times) * 1e6, emit_speedup)
+
+if __name__ == "__main__":
+    main()
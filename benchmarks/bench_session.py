@@ -0,0 +1,103 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Login throughput against the local session server stand-in
+# (mojang_standin.py): authenticates a number of players, joins them to
+# a server and then compares hasJoined checks done with one new
+# connection per request, sequentially through a SessionService and
+# batched through SessionService.has_joined_many.
+#
+#   python benchmarks/bench_session.py [<players> [<delay ms> [<concurrency>]]]
+
+import sys
+import time
+import multiprocessing
+
+import requests
+
+import fastmc.auth
+from mojang_standin import StandinServer
+
+def start_standin(delay):
+    server = StandinServer(delay=delay)
+    proc = multiprocessing.Process(target=server.serve_forever)
+    proc.daemon = True
+    proc.start()
+    server.socket.close()
+    return proc, server
+
+def bare_check(base, pairs):
+    # what fastmc.auth.check_player used to do
+    for player_ign, server_hash in pairs:
+        r = requests.get('%s/hasJoined?username=%s&serverId=%s' % (
+            base, player_ign, server_hash))
+        assert r.status_code == 200
+
+def service_check(service, pairs):
+    for player_ign, server_hash in pairs:
+        assert service.has_joined(player_ign, server_hash)
+
+def service_check_many(service, pairs):
+    assert all(service.has_joined_many(pairs))
+
+def bench(name, func, *args):
+    start = time.time()
+    func(*args)
+    return name, time.time() - start
+
+def main():
+    players = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.01
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+
+    proc, standin = start_standin(delay)
+    service = fastmc.auth.SessionService(
+        auth_base = standin.auth_base,
+        session_base = standin.session_base,
+        max_concurrency = concurrency,
+    )
+    fastmc.auth.set_session_service(service)
+
+    pairs = []
+    for n in xrange(players):
+        session = fastmc.auth.Session.from_credentials("bot%d" % n, "secret")
+        server_hash = "%x" % n
+        assert fastmc.auth.join_server(session, server_hash)
+        pairs.append((session.player_ign, server_hash))
+
+    print "%d hasJoined checks, %.0fms server delay, concurrency %d" % (
+        players, delay * 1000, concurrency)
+    for name, elapsed in (
+        bench("new connection", bare_check, standin.session_base, pairs),
+        bench("keep-alive", service_check, service, pairs),
+        bench("batched", service_check_many, service, pairs),
+    ):
+        print "%-16s %7.2fs %8.0f checks/s" % (name, elapsed, players / elapsed)
+    proc.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Startup of a bot fleet against the session server stand-in: logs in
+# a number of accounts one by one with username and password, then
+# through a fastmc.tokens.TokenStore, first cold (authenticating) and
+# then warm (validating the stored tokens concurrently).
+#
+#   python benchmarks/bench_tokens.py [<accounts> [<delay ms> [<concurrency>]]]
+
+import os
+import sys
+import time
+import tempfile
+
+import fastmc.auth
+import fastmc.tokens
+from bench_session import start_standin
+
+def sequential(credentials):
+    for account, password in credentials:
+        fastmc.auth.Session.from_credentials(account, password)
+
+def token_store(path, credentials, concurrency):
+    sessions, errors = fastmc.tokens.TokenStore(path).sessions(credentials, concurrency)
+    assert not errors
+
+def main():
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+
+    proc, standin = start_standin(delay)
+    fastmc.auth.set_session_service(fastmc.auth.SessionService(
+        auth_base = standin.auth_base,
+        session_base = standin.session_base,
+        max_concurrency = concurrency,
+    ))
+    credentials = [("bot%d" % n, "secret") for n in xrange(accounts)]
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    os.unlink(path)
+
+    print "%d accounts, %.0fms server delay, concurrency %d" % (
+        accounts, delay * 1000, concurrency)
+    for name, func, args in (
+        ("authenticate", sequential, (credentials,)),
+        ("store (cold)", token_store, (path, credentials, concurrency)),
+        ("store (warm)", token_store, (path, credentials, concurrency)),
+    ):
+        start = time.time()
+        func(*args)
+        print "%-14s %7.2fs" % (name, time.time() - start)
+    os.unlink(path)
+    proc.terminate()
+
+if __name__ == "__main__":
+    main()
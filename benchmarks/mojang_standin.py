@@ -0,0 +1,190 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Local stand-in for the Mojang authentication server and session
+# server, good enough to benchmark logins without the network. Any
+# username/password combination is accepted. delay adds a fixed latency
+# to every request to simulate the round trip to the real servers.
+#
+#   python benchmarks/mojang_standin.py [<port> [<delay ms>]]
+#
+# Point a fastmc.auth.SessionService at it with
+#
+#   SessionService(auth_base="http://127.0.0.1:<port>",
+#                  session_base="http://127.0.0.1:<port>/session/minecraft")
+
+import sys
+import time
+import uuid
+import hashlib
+import threading
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+import simplejson as json
+
+class StandinState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = {}    # access token -> profile
+        self.joined = {}    # (name, server id) -> profile
+        self.profiles = {}  # id -> profile
+
+    def profile(self, name):
+        profile = {
+            'id': hashlib.md5("OfflinePlayer:" + name).hexdigest(),
+            'name': name,
+        }
+        self.profiles[profile['id']] = profile
+        return profile
+
+    def with_properties(self, profile):
+        textures = json.dumps({
+            'timestamp': int(time.time() * 1000),
+            'profileId': profile['id'],
+            'profileName': profile['name'],
+            'textures': {},
+        })
+        return dict(profile, properties=[{
+            'name': 'textures',
+            'value': textures.encode('base64').replace("\n", ""),
+        }])
+
+    def new_token(self, profile):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = profile
+        return token
+
+class StandinHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, data=None):
+        body = "" if data is None else json.dumps(data)
+        self.send_response(status)
+        if data is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def forbidden(self, message):
+        self.reply(403, {
+            'error': 'ForbiddenOperationException',
+            'errorMessage': message,
+        })
+
+    def do_POST(self):
+        time.sleep(self.server.delay)
+        state = self.server.state
+        data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or "{}")
+        path = self.path
+
+        if path == "/authenticate":
+            profile = state.profile(data['username'])
+            self.reply(200, {
+                'accessToken': state.new_token(profile),
+                'clientToken': data.get('clientToken'),
+                'selectedProfile': profile,
+                'availableProfiles': [profile],
+            })
+        elif path == "/refresh":
+            with state.lock:
+                profile = state.tokens.pop(data.get('accessToken'), None)
+            if profile is None:
+                return self.forbidden("Invalid token.")
+            self.reply(200, {
+                'accessToken': state.new_token(profile),
+                'clientToken': data.get('clientToken'),
+                'selectedProfile': profile,
+            })
+        elif path == "/validate":
+            if data.get('accessToken') not in state.tokens:
+                return self.forbidden("Invalid token.")
+            self.reply(204)
+        elif path == "/invalidate":
+            with state.lock:
+                state.tokens.pop(data.get('accessToken'), None)
+            self.reply(204)
+        elif path == "/session/minecraft/join":
+            profile = state.tokens.get(data.get('accessToken'))
+            if profile is None or profile['id'] != data.get('selectedProfile'):
+                return self.forbidden("Invalid token.")
+            with state.lock:
+                state.joined[profile['name'], data['serverId']] = profile
+            self.reply(204)
+        else:
+            self.reply(404, {'errorMessage': 'Not Found'})
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        state = self.server.state
+        url = urlparse.urlparse(self.path)
+        if url.path == "/session/minecraft/hasJoined":
+            query = urlparse.parse_qs(url.query)
+            key = query.get('username', [''])[0], query.get('serverId', [''])[0]
+            profile = state.joined.get(key)
+        elif url.path.startswith("/session/minecraft/profile/"):
+            profile = state.profiles.get(url.path.rsplit("/", 1)[1])
+        else:
+            return self.reply(404, {'errorMessage': 'Not Found'})
+        if profile is None:
+            return self.reply(204)
+        self.reply(200, state.with_properties(profile))
+
+class StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address=('127.0.0.1', 0), delay=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandinHandler)
+        self.delay = delay
+        self.state = StandinState()
+
+    @property
+    def auth_base(self):
+        return "http://%s:%d" % self.server_address
+
+    @property
+    def session_base(self):
+        return self.auth_base + "/session/minecraft"
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0
+    server = StandinServer(('127.0.0.1', port), delay)
+    print "listening on %s" % server.auth_base
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,7 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import os
 import sys
 import logging
 logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
@@ -33,6 +34,10 @@ import gevent.socket
 
 import fastmc.proto
 import fastmc.auth
+import fastmc.tokens
+
+# reuse access tokens between runs
+TOKEN_STORE = os.path.expanduser("~/.fastmc-tokens.json")
 
 def handle_pkt(session, reader, writer, sock, pkt):
     if reader.state == fastmc.proto.LOGIN:
@@ -99,7 +104,7 @@ def client(session, sock, host, port):
     protocol_version = 47
 
     sock = fastmc.proto.MinecraftSocket(sock)
-    in_buf = fastmc.proto.ReadBuffer()
+    in_buf = fastmc.proto.ByteArrayReadBuffer()
     reader, writer = fastmc.proto.Endpoint.client_pair(protocol_version)
 
     out_buf = fastmc.proto.WriteBuffer()
@@ -117,19 +122,14 @@ def client(session, sock, host, port):
     sock.send(out_buf)
 
     while 1:
-        data = sock.recv()
-        if not data:
+        if not sock.recv_into(in_buf, reader.bytes_needed()):
             break
-        in_buf.append(data)
-        while 1:
-            pkt, pkt_raw = reader.read(in_buf)
-            if pkt is None:
-                break
+        for pkt in reader.iter_read(in_buf):
             handle_pkt(session, reader, writer, sock, pkt)
     sock.close()
 
 def do_client(username, password, host, port):
-    session = fastmc.auth.Session.from_credentials(username, password)
+    session = fastmc.tokens.TokenStore(TOKEN_STORE).session(username, password)
     sock = gevent.socket.create_connection((host, port))
     try:
         client(session, sock, host, port)
@@ -57,11 +57,7 @@ def pinger(sock, host, port):
             break
         in_buf.append(data)
 
-        while 1:
-            pkt, pkt_raw = reader.read(in_buf)
-            if pkt is None:
-                break
-
+        for pkt in reader.iter_read(in_buf):
             if pkt.id == protocol.StatusClientboundResponse.id:
                 out_buf = fastmc.proto.WriteBuffer()
                 writer.write(out_buf, protocol.StatusServerboundPing.id,
@@ -0,0 +1,69 @@
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Transparent proxy for offline-mode servers: Client connections
+# are forwarded to the upstream server without decoding the packets.
+
+import sys
+import logging
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+import gevent
+import gevent.socket
+from gevent.server import StreamServer
+
+import fastmc.proto
+import fastmc.proxy
+
+def handle(sock, addr, upstream):
+    protocol_version = 47
+
+    server_sock = gevent.socket.create_connection(upstream)
+    proxy = fastmc.proxy.PassthroughProxy(
+        fastmc.proto.MinecraftSocket(sock),
+        fastmc.proto.MinecraftSocket(server_sock),
+        protocol_version,
+    )
+    pumps = [
+        gevent.spawn(proxy.pump_client_to_server),
+        gevent.spawn(proxy.pump_server_to_client),
+    ]
+    gevent.wait(pumps, count=1)
+    gevent.killall(pumps)
+    sock.close()
+    server_sock.close()
+    print "%s:%d disconnected (%d frames forwarded, %d reencoded)" % (
+        addr[0], addr[1], proxy.forwarded, proxy.reencoded)
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 1:
+        print "%s <host> [<port>] [<listen port>]" % sys.argv[0]
+        sys.exit(0)
+    upstream = sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 25565
+    listen_port = int(sys.argv[3]) if len(sys.argv) > 3 else 25566
+    listener = StreamServer(('127.0.0.1', listen_port), lambda sock, addr: handle(sock, addr, upstream))
+    listener.serve_forever()
@@ -27,22 +27,26 @@
 
 import sys
 import pprint
-import uuid
 import logging
-import json
 logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
-import gevent
-from gevent.server import StreamServer
-
 import fastmc.auth
 import fastmc.proto
+import fastmc.runner
+import fastmc.offload
+import fastmc.profiles
+
+# RSA keys are shared by all connections and generated before the
+# workers are forked. The RSA process pool is started in each worker.
+key_pool = fastmc.auth.KeyPool()
+rsa_offload = None
+
+profile_cache = fastmc.profiles.ProfileCache()
 
 class Server(object):
-    def __init__(self):
-        self.token = fastmc.auth.generate_challenge_token()
-        self.server_id = fastmc.auth.generate_server_id()
-        self.key = fastmc.auth.generate_key_pair()
+    def __init__(self, stats):
+        self.stats = stats
+        self.handshake = fastmc.auth.ServerHandshake(key_pool, rsa_offload)
 
     def handle_pkt(self, pkt):
         print pkt
@@ -86,22 +90,13 @@ class Server(object):
 
                 self.player_ign = pkt.name
 
-                self.writer.write(out_buf, 0x01, 
-                    server_id = self.server_id,
-                    public_key = fastmc.auth.encode_public_key(self.key),
-                    challenge_token = self.token,
+                self.writer.write(out_buf, 0x01,
+                    **self.handshake.encryption_request()
                 )
                 self.sock.send(out_buf)
             elif pkt.id == 0x01:
-                decrypted_token = fastmc.auth.decrypt_with_private_key(
-                    pkt.response_token, self.key
-                )
-
-                if decrypted_token != self.token:
-                    raise Exception("Token verification failed")
-
-                shared_secret = fastmc.auth.decrypt_with_private_key(
-                    pkt.shared_secret, self.key
+                shared_secret = self.handshake.verify(
+                    pkt.shared_secret, pkt.response_token
                 )
 
                 self.sock.set_cipher(
@@ -109,25 +104,21 @@ class Server(object):
                     fastmc.auth.generated_cipher(shared_secret),
                 )
 
-                server_hash = fastmc.auth.make_server_hash(
-                    server_id = self.server_id,
-                    shared_secret = shared_secret,
-                    key = self.key,
-                )
+                server_hash = self.handshake.server_hash(shared_secret)
 
-                check = fastmc.auth.check_player(self.player_ign, server_hash)
+                check = profile_cache.check_player(self.player_ign, server_hash)
                 if not check:
                     raise Exception("Cannot verify your username. Sorry.")
 
                 print
                 print "Player information from Mojang"
                 print "---------------------------------------"
-                pprint.pprint(check)
+                pprint.pprint(check.raw)
 
                 print
                 print "Decoded Property Values"
                 print "---------------------------------------"
-                pprint.pprint(json.loads(check['properties'][0]['value'].decode('base64')))
+                pprint.pprint(check.properties)
 
                 out_buf = fastmc.proto.WriteBuffer()
 
@@ -143,7 +134,7 @@ class Server(object):
                 self.writer.set_compression_threshold(threshold)
 
                 self.writer.write(out_buf, 0x02, 
-                    uuid = str(uuid.UUID(check['id'])),
+                    uuid = check.uuid,
                     username = self.player_ign,
                 )
 
@@ -175,25 +166,28 @@ class Server(object):
         self.sock = fastmc.proto.MinecraftSocket(sock)
         self.reader, self.writer = fastmc.proto.Endpoint.server_pair(protocol_version)
 
-        in_buf = fastmc.proto.ReadBuffer()
+        in_buf = fastmc.proto.ByteArrayReadBuffer()
         while 1:
-            data = self.sock.recv()
-            if not data:
+            if not self.sock.recv_into(in_buf, self.reader.bytes_needed()):
                 break
-            in_buf.append(data)
-            while 1:
-                pkt, pkt_raw = self.reader.read(in_buf)
-                if pkt is None:
-                    break
+            for pkt in self.reader.iter_read(in_buf):
+                self.stats.incr("packets")
                 self.handle_pkt(pkt)
 
         print "client disconnected"
         sock.close()
 
 
-def handle(sock, addr):
-    gevent.spawn(Server().reader, sock)
+def handle(stats, sock, addr):
+    global rsa_offload
+    if rsa_offload is None:
+        rsa_offload = fastmc.offload.RSAOffload(processes=2)
+    Server(stats).reader(sock)
 
-listener = StreamServer(('127.0.0.1', 25565), handle)
-listener.start()
-listener.serve_forever()
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    # runner.stats is only set in the worker processes
+    runner = fastmc.runner.ServerRunner(
+        lambda sock, addr: handle(runner.stats, sock, addr),
+        ('127.0.0.1', 25565), workers=workers)
+    runner.run()
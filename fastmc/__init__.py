@@ -26,11 +26,15 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import fastmc.auth
+import fastmc.cipher
 import fastmc.util
 
 from fastmc.proto import (
     ReadBuffer,
+    ByteArrayReadBuffer,
     WriteBuffer,
+    ByteArrayWriteBuffer,
+    FrameReader,
 
     Slot,
     Vector,
@@ -45,6 +49,13 @@ from fastmc.proto import (
     ProtocolVersion,
     Endpoint,
     MinecraftSocket,
+    RawPacket,
+    PreparedFrame,
+    CompressionPolicy,
+
+    PACKET_PARSE,
+    PACKET_RAW,
+    PACKET_DROP,
 
     CLIENTBOUND,
     SERVERBOUND,
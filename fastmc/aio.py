@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# asyncio integration: MinecraftProtocol runs an Endpoint pair on top
+# of an asyncio transport. On Python 2 the trollius backport is used.
+
+import logging
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from fastmc.proto import (
+    ByteArrayReadBuffer,
+    WriteBuffer,
+    Endpoint,
+)
+
+log = logging.getLogger(__name__)
+
+class MinecraftProtocol(asyncio.Protocol):
+    # Decoded packets are either passed to the on_packet callback or,
+    # without callback, queued for get_packet(). get_packet returns a
+    # future resolving to the next packet (None once the connection is
+    # closed). Reading is paused while more than max_queued packets are
+    # waiting to be fetched.
+    #
+    # Outgoing packets are collected in a buffer and handed to the
+    # transport once per event loop iteration.
+
+    @classmethod
+    def client(cls, protocol_version, **kwargs):
+        reader, writer = Endpoint.client_pair(protocol_version)
+        return cls(reader, writer, **kwargs)
+
+    @classmethod
+    def server(cls, protocol_version, **kwargs):
+        reader, writer = Endpoint.server_pair(protocol_version)
+        return cls(reader, writer, **kwargs)
+
+    def __init__(self, reader, writer, on_packet=None, on_close=None, max_queued=1024, loop=None):
+        self._reader = reader
+        self._writer = writer
+        self._on_packet = on_packet
+        self._on_close = on_close
+        self._loop = loop or asyncio.get_event_loop()
+        self._queue = asyncio.Queue(loop=self._loop) if on_packet is None else None
+        self._max_queued = max_queued
+        self._paused = False
+
+        self._in_buf = ByteArrayReadBuffer()
+        self._out_buf = WriteBuffer()
+        self._flush_scheduled = False
+        self._encrypt = None
+        self._decrypt = None
+        self.transport = None
+
+    @property
+    def reader(self):
+        return self._reader
+
+    @property
+    def writer(self):
+        return self._writer
+
+    def set_cipher(self, send_cipher, recv_cipher):
+        # Everything written so far is still sent unencrypted
+        self.flush()
+        self._encrypt = send_cipher.encrypt
+        self._decrypt = recv_cipher.decrypt
+        log.debug("set send/recv cipher")
+
+    def switch_state(self, state):
+        self._reader.switch_state(state)
+        self._writer.switch_state(state)
+
+    def set_compression_threshold(self, compression_threshold):
+        self._reader.set_compression_threshold(compression_threshold)
+        self._writer.set_compression_threshold(compression_threshold)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        if self._decrypt:
+            data = self._decrypt(data)
+        self._in_buf.append(data)
+        on_packet = self._on_packet
+        if on_packet is not None:
+            for pkt in self._reader.iter_read(self._in_buf):
+                on_packet(self, pkt)
+        else:
+            queue = self._queue
+            for pkt in self._reader.iter_read(self._in_buf):
+                queue.put_nowait(pkt)
+            if not self._paused and queue.qsize() > self._max_queued:
+                self._paused = True
+                self.transport.pause_reading()
+
+    def connection_lost(self, exc):
+        log.debug("connection lost: %s" % (exc,))
+        if self._queue is not None:
+            self._queue.put_nowait(None)
+        if self._on_close is not None:
+            self._on_close(self, exc)
+
+    def get_packet(self):
+        if self._paused and self._queue.qsize() <= self._max_queued / 2:
+            self._paused = False
+            self.transport.resume_reading()
+        return self._queue.get()
+
+    def write(self, pkt_id, **data):
+        self._writer.write(self._out_buf, pkt_id, **data)
+        self._schedule_flush()
+
+    def write_pkt(self, pkt):
+        self._writer.write_pkt(self._out_buf, pkt)
+        self._schedule_flush()
+
+    def write_prepared(self, frame):
+        self._writer.write_prepared(self._out_buf, frame)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self.flush)
+
+    def flush(self):
+        self._flush_scheduled = False
+        data = self._out_buf.getvalue()
+        if not data:
+            return
+        self._out_buf = WriteBuffer()
+        if self._encrypt:
+            data = self._encrypt(data)
+        self.transport.write(data)
+
+    def close(self):
+        self.flush()
+        self.transport.close()
+
+def connect(host, port, protocol_version, loop=None, **kwargs):
+    # Returns a coroutine resolving to (transport, protocol)
+    loop = loop or asyncio.get_event_loop()
+    return loop.create_connection(
+        lambda: MinecraftProtocol.client(protocol_version, loop=loop, **kwargs),
+        host, port
+    )
+
+def serve(host, port, protocol_version, loop=None, **kwargs):
+    # Returns a coroutine resolving to the asyncio server
+    loop = loop or asyncio.get_event_loop()
+    return loop.create_server(
+        lambda: MinecraftProtocol.server(protocol_version, loop=loop, **kwargs),
+        host, port
+    )
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Ahead of time generation of the packet code.
+#
+# Writes one module per protocol version into the fastmc.generated
+# package. Each module contains the classes of all packets of that
+# version and the dispatch table mapping state, side and packet id to
+# them. fastmc.proto imports these modules instead of generating and
+# exec'ing the code at runtime, as long as they were generated by the
+# same codegen (CODE_TAG) from the same packet definitions. Otherwise
+# the module is ignored with a warning, so rerun the generator after
+# changing either. Being regular modules, the parsers show up with
+# real file names and line numbers in profilers, tracebacks and
+# coverage.
+#
+# Run it in the source directory before installing, setup.py includes
+# the fastmc.generated package if it exists.
+#
+#   python -m fastmc.aot [<protocol version> ...]
+
+import os
+import sys
+import py_compile
+
+from fastmc.proto import (
+    ProtocolVersion,
+    PACKET_GLOBALS,
+    GENERATED_PACKAGE,
+    CODE_TAG,
+    STATES,
+    SIDES,
+    definitions_key,
+    generate_packet_code,
+)
+
+HEADER = """\
+# Generated by fastmc.aot from the packet definitions of protocol %d.
+# Do not edit, rerun python -m fastmc.aot instead.
+"""
+
+def generate_module(protocol_version):
+    definitions = ProtocolVersion[protocol_version].definitions()
+    helpers = set()
+    classes = {}
+    body = []
+    for (state, side, pkt_id), (version, pkt_name, desc) in sorted(definitions.iteritems()):
+        class_name = "%s%s%s" % (STATES[state], SIDES[side], pkt_name)
+        if class_name in classes.values():
+            class_name = "%s_0x%02x" % (class_name, pkt_id)
+        classes[state, side, pkt_id] = class_name
+        source, packet_helpers = generate_packet_code(
+            version, pkt_id, pkt_name, desc, class_name, "_%s" % class_name)
+        helpers.update(packet_helpers)
+        body.append("")
+        body.append("# %s %s 0x%02x, defined in protocol %d" % (
+            STATES[state], SIDES[side], pkt_id, version))
+        body.append(source)
+        body.append("%s.__name__ = %r" % (class_name, pkt_name))
+
+    out = [HEADER % protocol_version]
+    out.append("from fastmc.proto import (")
+    for name in PACKET_GLOBALS + tuple(sorted(helpers - set(PACKET_GLOBALS))):
+        out.append("    %s," % name)
+    out.append(")")
+    out.append("")
+    out.append("PROTOCOL_VERSION = %d" % protocol_version)
+    out.append("CODE_TAG = %r" % CODE_TAG)
+    out.append("DEFINITIONS = %r" % definitions_key(definitions))
+    out.extend(body)
+    out.append("")
+    out.append("PACKETS = {")
+    for state in sorted(set(state for state, side, pkt_id in classes)):
+        out.append("    %d: ( # %s" % (state, STATES[state]))
+        for side, side_name in enumerate(SIDES):
+            out.append("        { # %s" % side_name)
+            for (pkt_state, pkt_side, pkt_id), class_name in sorted(classes.iteritems()):
+                if (pkt_state, pkt_side) == (state, side):
+                    out.append("            0x%02x: %s," % (pkt_id, class_name))
+            out.append("        },")
+        out.append("    ),")
+    out.append("}")
+    return "\n".join(out) + "\n"
+
+def generated_directory():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        *GENERATED_PACKAGE.split(".")[1:])
+
+def write_modules(protocol_versions, directory=None):
+    directory = directory or generated_directory()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    init = os.path.join(directory, "__init__.py")
+    if not os.path.exists(init):
+        with open(init, "wb") as f:
+            f.write("# Protocol modules generated by fastmc.aot\n")
+        py_compile.compile(init, doraise=True)
+    paths = []
+    for protocol_version in protocol_versions:
+        path = os.path.join(directory, "protocol_%d.py" % protocol_version)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(generate_module(protocol_version))
+        os.rename(tmp, path)
+        # ship the bytecode as well, compiling these modules is slow
+        py_compile.compile(path, doraise=True)
+        paths.append(path)
+    return paths
+
+def main():
+    protocol_versions = [int(arg) for arg in sys.argv[1:]] or sorted(ProtocolVersion)
+    try:
+        paths = write_modules(protocol_versions)
+    except (IOError, OSError), err:
+        sys.exit("cannot write generated modules: %s\n"
+                 "run fastmc.aot in the source directory before installing" % err)
+    for path in paths:
+        print "wrote %s" % path
+
+if __name__ == "__main__":
+    main()
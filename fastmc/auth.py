@@ -27,16 +27,20 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import time
 import logging
+import threading
 import hashlib
 from uuid import UUID
 from simplejson import dumps as json_dumps
 
 from Crypto.PublicKey import RSA
 from Crypto import Random
-from Crypto.Cipher import AES
 
 import requests
+import requests.adapters
+
+from fastmc.cipher import new_cipher
 
 log = logging.getLogger(__name__)
 
@@ -80,9 +84,9 @@ def decrypt_with_private_key(data, private_key):
     """Decrypts the PKCS#1 padded shared secret using the private RSA key"""
     return _pkcs1_unpad(private_key.decrypt(data))
 
-def generated_cipher(shared_secret):
-    """Creates a AES128 stream cipher using cfb8 mode"""
-    return AES.new(shared_secret, AES.MODE_CFB, shared_secret)
+def generated_cipher(shared_secret, backend=None):
+    """Creates a AES128 stream cipher using cfb8 mode (see fastmc.cipher)"""
+    return new_cipher(shared_secret, backend)
 
 def decode_public_key(bytes):
     """Decodes a public RSA key in ASN.1 format as defined by x.509"""
@@ -96,11 +100,224 @@ def encrypt_with_public_key(data, public_key):
     """Encrypts the PKCS#1 padded shared secret using the public RSA key"""
     return public_key.encrypt(_pkcs1_pad(data), 0)[0]
 
+class ServerKey(object):
+    """A RSA key pair together with its DER encoded public key"""
+    __slots__ = ('key', 'encoded', 'created')
+
+    def __init__(self, key):
+        self.key = key
+        self.encoded = encode_public_key(key)
+        self.created = time.time()
+
+    def decrypt(self, data):
+        return decrypt_with_private_key(data, self.key)
+
+class KeyPool(object):
+    # Generating a RSA key takes tens of milliseconds, so a server
+    # shouldn't create one per connection. KeyPool hands out a small
+    # set of shared keys round robin and replaces keys older than
+    # max_age, one per call to get(), so rotation cost is spread out.
+    def __init__(self, size=4, max_age=3600):
+        self._max_age = max_age
+        self._keys = [ServerKey(generate_key_pair()) for n in xrange(size)]
+        self._next = 0
+
+    def get(self):
+        idx = self._next
+        self._next = (idx + 1) % len(self._keys)
+        server_key = self._keys[idx]
+        if time.time() - server_key.created > self._max_age:
+            log.debug("rotating server key %d" % idx)
+            server_key = self._keys[idx] = ServerKey(generate_key_pair())
+        return server_key
+
+    def rotate(self):
+        self._keys = [ServerKey(generate_key_pair()) for n in xrange(len(self._keys))]
+
+class HandshakeException(Exception):
+    pass
+
+class ServerHandshake(object):
+    # Server side of the login encryption handshake for one connection:
+    #
+    #   handshake = ServerHandshake(key_pool)
+    #   writer.write(out_buf, 0x01, **handshake.encryption_request())
+    #   ...
+    #   shared_secret = handshake.verify(pkt.shared_secret, pkt.response_token)
+    #   server_hash = handshake.server_hash(shared_secret)
+    #
+    # decryptor is an object with a decrypt(server_key, blocks) method
+    # returning the decrypted blocks, e.g. fastmc.offload.RSAOffload to
+    # move the RSA work into a process pool. Without one, decryption
+    # happens inline.
+    def __init__(self, key_pool, decryptor=None, server_id=None):
+        self._server_key = key_pool.get()
+        self._decryptor = decryptor
+        self._server_id = generate_server_id() if server_id is None else server_id
+        self._token = generate_challenge_token()
+
+    @property
+    def server_id(self):
+        return self._server_id
+
+    @property
+    def server_key(self):
+        return self._server_key
+
+    def encryption_request(self):
+        return dict(
+            server_id = self._server_id,
+            public_key = self._server_key.encoded,
+            challenge_token = self._token,
+        )
+
+    def verify(self, shared_secret, response_token):
+        blocks = (shared_secret, response_token)
+        if self._decryptor is None:
+            shared_secret, token = [self._server_key.decrypt(block) for block in blocks]
+        else:
+            shared_secret, token = self._decryptor.decrypt(self._server_key, blocks)
+        if token != self._token:
+            raise HandshakeException("Token verification failed")
+        if shared_secret is None or len(shared_secret) != 16:
+            raise HandshakeException("Invalid shared secret")
+        return shared_secret
+
+    def server_hash(self, shared_secret):
+        return make_server_hash(self._server_id, shared_secret,
+            self._server_key.key, self._server_key.encoded)
+
 class SessionException(Exception):
     pass
 
+YGGDRASIL_BASE = "https://authserver.mojang.com"
+SESSION_BASE = "https://sessionserver.mojang.com/session/minecraft"
+
+class SessionService(object):
+    # HTTP client for the authentication server (auth_base) and the
+    # session server (session_base). requests.Session isn't thread safe,
+    # so every pool thread uses its own. They all share one HTTPAdapter
+    # and with it the pool of keep-alive connections.
+    #
+    # Requests run on a pool of max_concurrency threads (a gevent
+    # threadpool if gevent is installed), which bounds the number of
+    # requests in flight. Only the calling greenlet waits for the
+    # response. timeout is passed to requests as (connect, read) timeout.
+    #
+    # has_joined_async returns a result with a get() method.
+    # has_joined_many checks a list of (player_ign, server_hash) pairs
+    # concurrently and returns the results in the same order.
+    def __init__(self, auth_base=YGGDRASIL_BASE, session_base=SESSION_BASE,
+                 timeout=(5, 10), max_concurrency=16):
+        # fastmc.offload imports this module
+        from fastmc.offload import make_thread_pool
+        self.auth_base = auth_base
+        self.session_base = session_base
+        self._timeout = timeout
+        self._adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency)
+        self._local = threading.local()
+        self._pool = make_thread_pool(max_concurrency)
+
+    @property
+    def _http(self):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = requests.Session()
+            http.mount("http://", self._adapter)
+            http.mount("https://", self._adapter)
+        return http
+
+    def _post(self, url, data, headers=None):
+        return self._http.post(url, data=json_dumps(data),
+            headers=headers, timeout=self._timeout)
+
+    def _call(self, func, *args):
+        return self._pool.apply(func, args)
+
+    # auth_base overrides the service's auth_base for a single request
+    def request(self, endpoint, data, auth_base=None):
+        try:
+            log.debug("sending %s" % (data,))
+            r = self._call(self._post, (auth_base or self.auth_base) + endpoint, data)
+            if not r.ok:
+                try:
+                    error = r.json()['errorMessage']
+                except:
+                    error = "unknown error"
+                raise SessionException("%d: %s" % (r.status_code, error))
+            json = r.json()
+            log.debug("received %s" % (json,))
+            return json
+        except requests.exceptions.RequestException, err:
+            raise SessionException(err.message)
+
+    def validate(self, access_token, auth_base=None):
+        r = self._call(self._post, (auth_base or self.auth_base) + "/validate", {
+            'accessToken': access_token
+        })
+        return r.status_code in (200, 204)
+
+    def invalidate(self, access_token, auth_base=None):
+        r = self._call(self._post, (auth_base or self.auth_base) + "/invalidate", {
+            'accessToken': access_token
+        })
+        return r.status_code in (200, 204)
+
+    def join(self, session, server_hash):
+        r = self._call(self._post, self.session_base + "/join", {
+            'accessToken': session.access_token,
+            'selectedProfile': session.uuid_hex,
+            'serverId': server_hash,
+        }, {
+            'Content-Type': 'application/json', #; charset=utf-8',
+            'User-Agent': None,
+        })
+        return r.status_code in (200, 204)
+
+    def _has_joined(self, player_ign, server_hash):
+        r = self._http.get(self.session_base + "/hasJoined", params={
+            'username': player_ign,
+            'serverId': server_hash,
+        }, timeout=self._timeout)
+        return None if r.status_code != 200 else r.json()
+
+    def _profile(self, uuid_hex):
+        r = self._http.get(self.session_base + "/profile/" + uuid_hex,
+            timeout=self._timeout)
+        return None if r.status_code != 200 else r.json()
+
+    def profile(self, uuid):
+        return self._call(self._profile, UUID(uuid).hex)
+
+    def _has_joined_pair(self, pair):
+        return self._has_joined(*pair)
+
+    def has_joined(self, player_ign, server_hash):
+        return self._call(self._has_joined, player_ign, server_hash)
+
+    def has_joined_async(self, player_ign, server_hash):
+        return self._pool.apply_async(self._has_joined, (player_ign, server_hash))
+
+    def has_joined_many(self, pairs):
+        return list(self._pool.map(self._has_joined_pair, pairs))
+
+_session_service = None
+
+def get_session_service():
+    """Returns the SessionService used by Session and the module functions"""
+    global _session_service
+    if _session_service is None:
+        _session_service = SessionService()
+    return _session_service
+
+def set_session_service(service):
+    global _session_service
+    _session_service = service
+
 class Session(object):
-    YGGDRASIL_BASE = "https://authserver.mojang.com"
+    # Requests go to get_session_service().auth_base unless this is
+    # overridden, e.g. in a subclass, to reach another auth server.
+    YGGDRASIL_BASE = YGGDRASIL_BASE
 
     @classmethod
     def make_client_token(cls):
@@ -124,36 +341,43 @@ class Session(object):
         return cls(
             info['accessToken'], 
             info['selectedProfile']['name'], 
-            info['selectedProfile']['id']
+            info['selectedProfile']['id'],
+            info.get('clientToken', client_token),
         )
 
     @classmethod
-    def from_access_token(cls, access_token):
-        info = cls.do_request("/refresh", {
+    def from_access_token(cls, access_token, client_token=None):
+        request = {
             'accessToken': access_token
-        })
+        }
+        if client_token is not None:
+            request['clientToken'] = client_token
+        info = cls.do_request("/refresh", request)
 
         return cls(
             info['accessToken'], 
             info['selectedProfile']['name'], 
-            info['selectedProfile']['id']
+            info['selectedProfile']['id'],
+            info.get('clientToken', client_token),
         )
 
     @classmethod
-    def from_authinfo(cls, access_token, player_ign, player_uuid):
+    def from_authinfo(cls, access_token, player_ign, player_uuid, client_token=None):
         return cls(
             access_token,
             player_ign,
             player_uuid,
+            client_token,
         )
 
-    def __init__(self, access_token, player_ign, uuid):
+    def __init__(self, access_token, player_ign, uuid, client_token=None):
         self._access_token = access_token
         self._player_ign = player_ign
         self._uuid = UUID(uuid)
+        self._client_token = client_token
 
     def refresh(self):
-        return Session(self._access_token)
+        return self.from_access_token(self._access_token, self._client_token)
 
     @property
     def player_ign(self):
@@ -171,6 +395,10 @@ class Session(object):
     def access_token(self):
         return self._access_token
 
+    @property
+    def client_token(self):
+        return self._client_token
+
     @property
     def session_id(self):
         return 'token:%s:%s' % (self._access_token, self.uuid_hex)
@@ -180,56 +408,35 @@ class Session(object):
             self._player_ign, self._uuid, self._access_token)
 
     def validate(self):
-        r = requests.post(self.YGGDRASIL_BASE + "/validate", data=json_dumps({
-            'accessToken': self._access_token
-        }))
-        return r.status_code in (200, 204)
+        return get_session_service().validate(self._access_token, self._auth_base())
 
     def invalidate(self):
-        r = requests.post(self.YGGDRASIL_BASE + "/invalidate", data=json_dumps({
-            'accessToken': self._access_token
-        }))
-        return r.status_code in (200, 204)
+        return get_session_service().invalidate(self._access_token, self._auth_base())
+
+    @classmethod
+    def _auth_base(cls):
+        if cls.YGGDRASIL_BASE != YGGDRASIL_BASE:
+            return cls.YGGDRASIL_BASE
+        return None
 
     @classmethod
     def do_request(cls, endpoint, data):
-        try:
-            log.debug("sending %s" % (data,))
-            r = requests.post(cls.YGGDRASIL_BASE + endpoint, data=json_dumps(data))
-            if not r.ok:
-                try:
-                    error = r.json()['errorMessage']
-                except:
-                    error = "unknown error"
-                raise SessionException("%d: %s" % (r.status_code, error))
-            json = r.json()
-            log.debug("received %s" % (json,))
-            return json
-        except requests.exceptions.RequestException, err:
-            raise SessionException(err.message)
+        return get_session_service().request(endpoint, data, cls._auth_base())
 
-def make_server_hash(server_id, shared_secret, key):
+def make_server_hash(server_id, shared_secret, key, encoded_key=None):
+    if encoded_key is None:
+        encoded_key = encode_public_key(key)
     digest = hashlib.sha1()
     digest.update(server_id)
     digest.update(shared_secret)
-    digest.update(encode_public_key(key))
+    digest.update(encoded_key)
     d = long(digest.hexdigest(), 16)
     if d >> 39 * 4 & 0x8:
         return "-%x" % ((-d) & (2 ** (40 * 4) - 1))
     return "%x" % d
 
 def join_server(session, server_hash):
-    r = requests.post('https://sessionserver.mojang.com/session/minecraft/join', data=json_dumps({
-        'accessToken': session.access_token,
-        'selectedProfile': session.uuid_hex,
-        'serverId': server_hash,
-    }), headers = {
-        'Content-Type': 'application/json', #; charset=utf-8',
-        'User-Agent': None,
-    })
-    return r.status_code in (200, 204)
+    return get_session_service().join(session, server_hash)
 
 def check_player(player_ign, server_hash):
-    r = requests.get('https://sessionserver.mojang.com/session/minecraft/hasJoined?username=%s&serverId=%s' % (
-        player_ign, server_hash))
-    return None if r.status_code != 200 else r.json()
+    return get_session_service().has_joined(player_ign, server_hash)
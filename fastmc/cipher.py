@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# AES-128 in CFB8 mode, as used for the encrypted part of the protocol,
+# with selectable implementations.
+#
+# Each backend is a class taking the shared secret and returning a cipher
+# for one direction of a connection. Ciphers provide encrypt(data),
+# decrypt(data) and decrypt_into(buf), which decrypts a writable buffer
+# (bytearray or memoryview) in place. MinecraftSocket uses decrypt_into
+# to decrypt its receive arena without allocating strings.
+#
+# Backends register themselves if their library can be imported. Without
+# an explicit choice, the first available backend in BACKEND_PREFERENCE
+# is used.
+
+import logging
+
+log = logging.getLogger(__name__)
+
+BACKEND_PREFERENCE = ["cryptography", "pycryptodomex", "pycrypto"]
+
+_backends = {}
+_default_backend = None
+
+class CipherBackendError(Exception):
+    pass
+
+def register_backend(name, cls):
+    _backends[name] = cls
+
+def available_backends():
+    return [name for name in BACKEND_PREFERENCE if name in _backends] + sorted(
+        name for name in _backends if name not in BACKEND_PREFERENCE)
+
+def set_default_backend(name):
+    global _default_backend
+    if name is not None and name not in _backends:
+        raise CipherBackendError("cipher backend %s not available" % name)
+    _default_backend = name
+
+def get_backend(name=None):
+    if name is None:
+        name = _default_backend
+    if name is None:
+        backends = available_backends()
+        if not backends:
+            raise CipherBackendError("no AES cipher backend available")
+        name = backends[0]
+    try:
+        return _backends[name]
+    except KeyError:
+        raise CipherBackendError("cipher backend %s not available" % name)
+
+def new_cipher(shared_secret, backend=None):
+    return get_backend(backend)(shared_secret)
+
+def _as_bytes(buf):
+    if isinstance(buf, memoryview):
+        return buf.tobytes()
+    return buffer(buf)
+
+class CipherBase(object):
+    # Shared code of the backends. Each backend provides encrypt and
+    # decrypt itself.
+    name = None
+
+    def decrypt_into(self, buf):
+        buf[:] = self.decrypt(_as_bytes(buf))
+
+try:
+    from Crypto.Cipher import AES as _PyCryptoAES
+except ImportError:
+    pass
+else:
+    class PyCryptoCipher(CipherBase):
+        # pycrypto has no output buffer argument, so decrypt_into
+        # copies through a string.
+        name = "pycrypto"
+
+        def __init__(self, shared_secret):
+            cipher = _PyCryptoAES.new(shared_secret, _PyCryptoAES.MODE_CFB, shared_secret)
+            self.encrypt = cipher.encrypt
+            self.decrypt = cipher.decrypt
+
+    register_backend(PyCryptoCipher.name, PyCryptoCipher)
+
+try:
+    from Cryptodome.Cipher import AES as _CryptodomeAES
+except ImportError:
+    pass
+else:
+    class CryptodomeCipher(CipherBase):
+        name = "pycryptodomex"
+
+        def __init__(self, shared_secret):
+            cipher = _CryptodomeAES.new(shared_secret, _CryptodomeAES.MODE_CFB,
+                iv=shared_secret, segment_size=8)
+            self._cipher = cipher
+            self.encrypt = cipher.encrypt
+            self.decrypt = cipher.decrypt
+
+        def decrypt_into(self, buf):
+            self._cipher.decrypt(buf, output=buf)
+
+    register_backend(CryptodomeCipher.name, CryptodomeCipher)
+
+try:
+    from cryptography.hazmat.primitives.ciphers import (
+        Cipher as _Cipher,
+        algorithms as _algorithms,
+        modes as _modes,
+    )
+    from cryptography.hazmat.backends import default_backend as _default_openssl
+except ImportError:
+    pass
+else:
+    class OpenSSLCipher(CipherBase):
+        # CFB8 through OpenSSL. update_into wants an output buffer one
+        # block larger than the input, so decrypt_into decrypts into a
+        # reused scratch buffer and copies the result back.
+        name = "cryptography"
+
+        def __init__(self, shared_secret):
+            self._shared_secret = shared_secret
+            self._encryptor = None
+            self._decryptor = None
+            self._scratch = bytearray(0)
+            self._scratch_view = memoryview(self._scratch)
+
+        def _context(self):
+            return _Cipher(
+                _algorithms.AES(self._shared_secret),
+                _modes.CFB8(self._shared_secret),
+                _default_openssl(),
+            )
+
+        def encrypt(self, data):
+            if self._encryptor is None:
+                self._encryptor = self._context().encryptor()
+            return self._encryptor.update(data)
+
+        def decrypt(self, data):
+            if self._decryptor is None:
+                self._decryptor = self._context().decryptor()
+            return self._decryptor.update(data)
+
+        def decrypt_into(self, buf):
+            if self._decryptor is None:
+                self._decryptor = self._context().decryptor()
+            size = len(buf)
+            if size + 15 > len(self._scratch):
+                self._scratch = bytearray(max(size + 15, 2 * len(self._scratch)))
+                self._scratch_view = memoryview(self._scratch)
+            self._decryptor.update_into(buf, self._scratch_view)
+            buf[:] = self._scratch_view[:size]
+
+    register_backend(OpenSSLCipher.name, OpenSSLCipher)
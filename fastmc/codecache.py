@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# On disk cache for the code objects generated by proto.make_packet_type.
+#
+# Generating and compiling the parser code for all packets of all
+# protocol versions takes most of the import time of fastmc.proto. The
+# cache stores the compiled code objects in a single marshal file. The
+# file name contains a tag derived from everything the generated code
+# depends on (python version, the source of proto.py, codegen flags),
+# so changing any of those automatically uses a new file. Entries are
+# keyed by a hash of the packet definition itself. Saving the cache
+# removes the files of other tags from the directory.
+#
+# The cache is disabled by default. Setting FASTMC_CODE_CACHE to a
+# directory or calling fastmc.proto.enable_code_cache() enables it, the
+# latter defaults to $XDG_CACHE_HOME/fastmc (or ~/.cache/fastmc).
+# Setting FASTMC_NO_CODE_CACHE disables the cache in any case. Cache
+# files not owned by the current user or writable by others are ignored.
+
+import os
+import stat
+import imp
+import marshal
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)
+
+def default_directory():
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "fastmc")
+
+def make_tag(module_path, *flags):
+    # module_path is the __file__ of the module generating the code
+    digest = hashlib.sha1(imp.get_magic())
+    try:
+        with open(os.path.splitext(module_path)[0] + ".py", "rb") as f:
+            digest.update(f.read())
+    except IOError:
+        # only compiled modules installed, use their modification time
+        digest.update(repr(os.path.getmtime(module_path)))
+    digest.update(repr(flags))
+    return digest.hexdigest()[:16]
+
+def make_key(*args):
+    return hashlib.sha1(repr(args)).hexdigest()
+
+class CodeCache(object):
+    def __init__(self, directory, tag, prefix="proto"):
+        self._prefix = prefix
+        self._path = os.path.join(directory, "%s-%s.marshal" % (prefix, tag))
+        self._entries = None
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    def load(self):
+        try:
+            with open(self._path, "rb") as f:
+                info = os.fstat(f.fileno())
+                if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                    raise ValueError("not owned by the current user or writable by others")
+                entries = marshal.load(f)
+            if not isinstance(entries, dict):
+                raise ValueError("not a dict")
+        except IOError:
+            entries = {}
+        except (EOFError, ValueError, TypeError), err:
+            log.warning("ignoring broken code cache %s: %s" % (self._path, err))
+            entries = {}
+        self._entries = entries
+        log.debug("loaded %d cached code objects from %s" % (len(entries), self._path))
+
+    def get(self, key):
+        if self._entries is None:
+            self.load()
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self._entries is None:
+            self.load()
+        self._entries[key] = value
+        self._dirty = True
+
+    def save(self):
+        # Writes the cache if entries were added. Failing to write it
+        # (read-only home directory, ...) isn't fatal.
+        if not self._dirty:
+            return
+        self._dirty = False
+        directory = os.path.dirname(self._path)
+        tmp = "%s.%d.tmp" % (self._path, os.getpid())
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tmp, "wb") as f:
+                marshal.dump(self._entries, f)
+            os.rename(tmp, self._path)
+        except (IOError, OSError), err:
+            log.warning("cannot write code cache %s: %s" % (self._path, err))
+            return
+        log.debug("saved %d code objects to %s" % (len(self._entries), self._path))
+        self.prune()
+
+    def prune(self):
+        # Removes cache files of other tags
+        directory, name = os.path.split(self._path)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for other in names:
+            if other == name or not other.startswith(self._prefix + "-") or not other.endswith(".marshal"):
+                continue
+            try:
+                os.unlink(os.path.join(directory, other))
+            except OSError, err:
+                log.warning("cannot remove stale code cache %s: %s" % (other, err))
+            else:
+                log.debug("removed stale code cache %s" % other)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Moves CPU heavy work off the event loop.
+#
+# zlib releases the GIL, so large frames can be compressed and
+# decompressed on worker threads while the event loop keeps running.
+# ZlibOffload is a CompressionPolicy doing exactly that for frames of at
+# least min_size bytes. Smaller frames are handled inline.
+#
+# The calling greenlet (or thread) waits for the result, so the order of
+# frames on a connection is preserved while other connections continue
+# to be served. With gevent installed, a gevent threadpool is used, so
+# only the calling greenlet blocks. Otherwise a multiprocessing
+# ThreadPool is used, which blocks the calling thread.
+
+import zlib
+import multiprocessing
+
+from Crypto import Random
+from Crypto.PublicKey import RSA
+
+from fastmc.proto import CompressionPolicy, thread_cpu_time
+from fastmc.auth import decrypt_with_private_key
+
+def _timed(func, *args):
+    # Runs in a pool thread, so it has to measure that thread's time
+    start = thread_cpu_time()
+    result = func(*args)
+    return result, thread_cpu_time() - start
+
+def make_thread_pool(threads):
+    try:
+        from gevent.threadpool import ThreadPool
+    except ImportError:
+        from multiprocessing.pool import ThreadPool
+    return ThreadPool(threads)
+
+class ZlibOffload(CompressionPolicy):
+    def __init__(self, min_size=65536, threads=4, pool=None, **kwargs):
+        CompressionPolicy.__init__(self, **kwargs)
+        self._min_size = min_size
+        self._pool = pool if pool is not None else make_thread_pool(threads)
+        self._apply = self._pool.apply
+
+    def compress(self, pkt_id, data):
+        if len(data) < self._min_size:
+            return CompressionPolicy.compress(self, pkt_id, data)
+        compressed, cpu_time = self._apply(_timed, (zlib.compress, data, self.get_level(pkt_id)))
+        if self._collect_stats:
+            self._record(pkt_id, cpu_time, len(data), len(compressed))
+        return compressed
+
+    def decompress(self, data, size):
+        if size < self._min_size:
+            return zlib.decompress(data)
+        return self._apply(zlib.decompress, (data,))
+
+# RSA decryption of the login secrets holds the GIL, so RSAOffload runs
+# it in a process pool. It implements the decryptor interface expected
+# by fastmc.auth.ServerHandshake. pycrypto keys can't be pickled, so the
+# private key is sent DER encoded and each worker process keeps the
+# imported keys around.
+
+_worker_keys = {}
+
+def _rsa_decrypt(encoded_key, blocks):
+    key = _worker_keys.get(encoded_key)
+    if key is None:
+        if len(_worker_keys) >= 64:
+            _worker_keys.clear()
+        key = _worker_keys[encoded_key] = RSA.importKey(encoded_key)
+    return [decrypt_with_private_key(block, key) for block in blocks]
+
+class RSAOffload(object):
+    def __init__(self, processes=None, threads=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self._processes = multiprocessing.Pool(processes, Random.atfork)
+        # waiting for a result blocks, so do that on a thread
+        self._waiters = make_thread_pool(threads or 2 * processes)
+        self._private_keys = {}
+
+    def _encode_private(self, server_key):
+        encoded = self._private_keys.get(server_key.encoded)
+        if encoded is None:
+            if len(self._private_keys) >= 64:
+                self._private_keys.clear()
+            encoded = server_key.key.exportKey(format="DER")
+            self._private_keys[server_key.encoded] = encoded
+        return encoded
+
+    def decrypt(self, server_key, blocks):
+        return self._waiters.apply(self._processes.apply,
+            (_rsa_decrypt, (self._encode_private(server_key), list(blocks))))
+
+    def close(self):
+        self._processes.terminate()
+        self._processes.join()
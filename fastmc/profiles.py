@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Cache for player profiles returned by the session server.
+#
+# Profiles are stored with their properties already decoded (the
+# textures property is base64 encoded json), keyed by uuid and
+# case-insensitively by player name. Entries expire after ttl seconds
+# and the least recently used entries are dropped once the cache holds
+# max_size profiles. With snapshot_path set, the cache is loaded from
+# that file on creation, so a restarted server starts warm. Snapshots
+# are not written automatically: Call save (e.g. on shutdown or from
+# a timer) to write one.
+#
+# hasJoined checks depend on the server hash of a single login and are
+# never answered from the cache, but check_player stores the returned
+# profile, so later lookups by uuid or name are hits. If the cached
+# profile of the player is still fresh and unchanged, check_player
+# returns it instead of decoding the response again.
+
+import os
+import time
+import logging
+from uuid import UUID
+from collections import namedtuple, OrderedDict
+
+import simplejson as json
+
+import fastmc.auth
+
+log = logging.getLogger(__name__)
+
+Profile = namedtuple("Profile", "uuid name properties raw")
+
+def decode_properties(properties):
+    decoded = {}
+    for prop in properties:
+        value = prop['value']
+        if prop['name'] == 'textures':
+            value = json.loads(value.decode('base64'))
+        decoded[prop['name']] = value
+    return decoded
+
+def decode_profile(raw):
+    return Profile(
+        uuid = str(UUID(raw['id'])),
+        name = raw['name'],
+        properties = decode_properties(raw.get('properties', ())),
+        raw = raw,
+    )
+
+class ProfileCache(object):
+    def __init__(self, service=None, ttl=3600, max_size=10000, snapshot_path=None):
+        self._service = service
+        self._ttl = ttl
+        self._max_size = max_size
+        self._snapshot_path = snapshot_path
+        self._profiles = OrderedDict()  # uuid hex -> (expires, Profile)
+        self._names = {}                # lower case name -> uuid hex
+        self.hits = 0
+        self.misses = 0
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            self.load(snapshot_path)
+
+    @property
+    def service(self):
+        if self._service is None:
+            return fastmc.auth.get_session_service()
+        return self._service
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._profiles))
+
+    def _unindex(self, key, profile):
+        # The name might already belong to a different uuid
+        name = profile.name.lower()
+        if self._names.get(name) == key:
+            del self._names[name]
+
+    def _store(self, raw, expires):
+        profile = decode_profile(raw)
+        key = UUID(profile.uuid).hex
+        old = self._profiles.pop(key, None)
+        if old is not None:
+            self._unindex(key, old[1])
+        self._profiles[key] = expires, profile
+        self._names[profile.name.lower()] = key
+        while len(self._profiles) > self._max_size:
+            evicted_key, (_, evicted) = self._profiles.popitem(last=False)
+            self._unindex(evicted_key, evicted)
+        return profile
+
+    def put(self, raw):
+        return self._store(raw, time.time() + self._ttl)
+
+    def _get(self, key):
+        entry = self._profiles.pop(key, None)
+        if entry is None:
+            return None
+        expires, profile = entry
+        if expires < time.time():
+            self._unindex(key, profile)
+            return None
+        # reinsert as most recently used
+        self._profiles[key] = entry
+        return profile
+
+    def get(self, uuid):
+        profile = self._get(UUID(uuid).hex)
+        if profile is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return profile
+
+    def get_by_name(self, player_ign):
+        key = self._names.get(player_ign.lower())
+        profile = None if key is None else self._get(key)
+        if profile is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return profile
+
+    def profile(self, uuid):
+        profile = self.get(uuid)
+        if profile is None:
+            raw = self.service.profile(uuid)
+            if raw is not None:
+                profile = self.put(raw)
+        return profile
+
+    def check_player(self, player_ign, server_hash):
+        # The hasJoined request is the authentication and always made
+        raw = self.service.has_joined(player_ign, server_hash)
+        if raw is None:
+            return None
+        # Not a lookup by the caller, so the hit/miss counters aren't
+        # touched
+        key = self._names.get(player_ign.lower())
+        profile = None if key is None else self._get(key)
+        if profile is not None and profile.raw == raw:
+            return profile
+        return self.put(raw)
+
+    def invalidate(self, uuid):
+        key = UUID(uuid).hex
+        entry = self._profiles.pop(key, None)
+        if entry is not None:
+            self._unindex(key, entry[1])
+
+    def clear(self):
+        self._profiles.clear()
+        self._names.clear()
+
+    def save(self, path=None):
+        path = path or self._snapshot_path
+        now = time.time()
+        entries = [
+            (expires, profile.raw)
+            for expires, profile in self._profiles.itervalues()
+            if expires >= now
+        ]
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            json.dump(entries, f)
+        os.rename(tmp, path)
+        log.debug("saved %d profiles to %s" % (len(entries), path))
+
+    def load(self, path=None):
+        path = path or self._snapshot_path
+        with open(path, "rb") as f:
+            entries = json.load(f)
+        now = time.time()
+        loaded = 0
+        for expires, raw in entries:
+            if expires >= now:
+                self._store(raw, expires)
+                loaded += 1
+        log.debug("loaded %d profiles from %s" % (loaded, path))
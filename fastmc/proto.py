@@ -29,6 +29,10 @@
 
 import re
 import os
+import sys
+import zlib
+import time
+import atexit
 import logging
 
 from array import array
@@ -38,15 +42,46 @@ from cStringIO import StringIO
 from itertools import izip
 from simplejson import loads as json_loads, dumps as json_dumps
 
+from fastmc import codecache
+
 log = logging.getLogger(__name__)
 
 OPTIMIZE = not bool(os.getenv("FASTMC_NO_OPTIMIZE"))
+INLINE_VARINT = OPTIMIZE and not bool(os.getenv("FASTMC_NO_INLINE_VARINT"))
 DEBUG_PARSER = bool(os.getenv("FASTMC_DEBUG_PARSER"))
 DEBUG_PACKET = bool(os.getenv("FASTMC_DEBUG_PACKET"))
 
+# Identifies the codegen: everything the generated code depends on
+CODE_TAG = codecache.make_tag(__file__, OPTIMIZE, INLINE_VARINT, DEBUG_PACKET)
+
+# Generated code can be cached on disk, see fastmc.codecache. The cache
+# is opt-in. Printing the generated source requires generating it.
+CODE_CACHE = None
+
+def _save_code_cache():
+    if CODE_CACHE is not None:
+        CODE_CACHE.save()
+
+def enable_code_cache(directory=None):
+    # Has to be called before the protocols in use are built
+    global CODE_CACHE
+    if DEBUG_PARSER or os.getenv("FASTMC_NO_CODE_CACHE"):
+        return
+    if CODE_CACHE is None:
+        atexit.register(_save_code_cache)
+    CODE_CACHE = codecache.CodeCache(directory or codecache.default_directory(), CODE_TAG)
+
+if os.getenv("FASTMC_CODE_CACHE"):
+    enable_code_cache(os.getenv("FASTMC_CODE_CACHE"))
+
+# Protocols are loaded from modules generated ahead of time by
+# fastmc.aot if they exist and match the current codegen.
+USE_GENERATED = not (os.getenv("FASTMC_NO_GENERATED") or DEBUG_PARSER)
+
 class ReadBuffer(object):
     __slots__ = [
         "_max_size", 
+        "_size",
         "_buffer_trunc",
         "_buffer_tell", 
         "_buffer_read", 
@@ -68,6 +103,7 @@ class ReadBuffer(object):
         self._buffer_trunc(0)
         self._buffer_write(data)
         self._buffer_seek(0, 0)
+        self._size = len(data)
 
     def append(self, data):
         read_pos = self._buffer_tell()
@@ -77,19 +113,196 @@ class ReadBuffer(object):
             read_pos = 0
         self._buffer_seek(0, 2)
         self._buffer_write(data)
+        self._size = self._buffer_tell()
         self._buffer_seek(read_pos, 0)
 
+    def available(self):
+        return self._size - self._buffer_tell()
+
     def read(self, count):
         return self._buffer_read(count)
 
+    def read_varint(self):
+        return read_varint(self)
+
     def snapshot(self):
         return self._buffer_tell()
 
     def restore(self, read_pos):
         self._buffer_seek(read_pos, 0)
 
+class ByteArrayReadBuffer(object):
+    # Drop-in replacement for ReadBuffer backed by a bytearray with
+    # separate read/write cursors. read() hands out memoryview slices
+    # into the buffer instead of copied strings. These views are only
+    # valid until the next append(), as appending might move the
+    # remaining data to the front of the buffer.
+    __slots__ = [
+        "_buffer",
+        "_view",
+        "_read_pos",
+        "_write_pos",
+    ]
+
+    def __init__(self, data="", size=16384):
+        self._buffer = bytearray(max(size, len(data)))
+        self._view = memoryview(self._buffer)
+        self._read_pos = 0
+        self._write_pos = 0
+        self.init_buffer(data)
+
+    def init_buffer(self, data):
+        self._read_pos = self._write_pos = 0
+        self.append(data)
+
+    def append(self, data):
+        size = len(data)
+        read_pos, write_pos = self._read_pos, self._write_pos
+        live = write_pos - read_pos
+        if not live:
+            read_pos = write_pos = 0
+        if write_pos + size > len(self._buffer):
+            if read_pos > live and live + size <= len(self._buffer):
+                # The consumed prefix is larger than the remaining
+                # data, so moving it to the front is cheap. Source and
+                # destination overlap, so copy the data out first.
+                self._buffer[:live] = self._view[read_pos:write_pos].tobytes()
+            else:
+                # Never resize in place: the old bytearray stays valid
+                # for views that are still referenced somewhere.
+                log.debug("growing read buffer")
+                buf = bytearray(max(len(self._buffer) * 2, live + size))
+                buf[:live] = self._view[read_pos:write_pos]
+                self._buffer = buf
+                self._view = memoryview(buf)
+            read_pos, write_pos = 0, live
+        self._buffer[write_pos:write_pos + size] = data
+        self._read_pos = read_pos
+        self._write_pos = write_pos + size
+
+    def available(self):
+        return self._write_pos - self._read_pos
+
+    def read(self, count):
+        read_pos = self._read_pos
+        end = min(read_pos + count, self._write_pos)
+        self._read_pos = end
+        return self._view[read_pos:end]
+
+    def read_varint(self):
+        buf, pos, end = self._buffer, self._read_pos, self._write_pos
+        value = shift = 0
+        while pos < end:
+            byte = buf[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                self._read_pos = pos
+                if value > 0x7FFFFFFF: # 32 bit two's complement
+                    value -= 0x100000000
+                return value
+            shift += 7
+        return None
+
+    def snapshot(self):
+        return self._read_pos
+
+    def restore(self, read_pos):
+        self._read_pos = read_pos
+
 WriteBuffer = StringIO
 
+class ByteArrayWriteBuffer(object):
+    # Outbound buffer backed by a bytearray. Endpoint.write_pkt encodes
+    # packets (including the frame header) directly into it using
+    # write_packet instead of building temporary strings. write() keeps
+    # it usable wherever a WriteBuffer is expected. Reuse it after
+    # sending by calling clear().
+    __slots__ = [
+        "_buffer",
+        "_size",
+    ]
+
+    def __init__(self, size=4096):
+        self._buffer = bytearray(size)
+        self._size = 0
+
+    def reserve(self, count):
+        # Returns the bytearray and the offset to write count bytes
+        # at. Call commit with the new end offset once written.
+        size = self._size
+        if size + count > len(self._buffer):
+            # Never resize in place: views handed out by view() keep
+            # pointing to the old bytearray.
+            buf = bytearray(max(len(self._buffer) * 2, size + count))
+            buf[:size] = memoryview(self._buffer)[:size]
+            self._buffer = buf
+        return self._buffer, size
+
+    def commit(self, offset):
+        self._size = offset
+
+    def write(self, data):
+        buf, offset = self.reserve(len(data))
+        end = offset + len(data)
+        buf[offset:end] = data
+        self._size = end
+
+    def write_packet(self, pkt, compression_threshold, compression_policy=None):
+        # Same as the write_packet function, but the frame is encoded
+        # in place. Packets with fields that would have to be encoded
+        # twice (for size and emit_into) are encoded to a string first,
+        # as are frames that get compressed.
+        pkt_id = pkt.id
+        if pkt._sized:
+            data = None
+            size = pkt.size() + (1 if pkt_id < 0x80 else size_varint(pkt_id))
+        else:
+            raw = StringIO()
+            write_varint(raw, pkt_id)
+            pkt.emit(raw)
+            data = raw.getvalue()
+            size = len(data)
+        if compression_threshold is None:
+            header = size
+        elif size < compression_threshold:
+            header = size + 1
+        elif data is None:
+            return write_packet(self, pkt, compression_threshold, compression_policy)
+        else:
+            return write_frame(self, data, compression_threshold, compression_policy)
+        buf, offset = self._buffer, self._size
+        if offset + 5 + header > len(buf):
+            buf, offset = self.reserve(5 + header)
+        if header < 0x80:
+            buf[offset] = header
+            offset += 1
+        else:
+            offset = pack_varint_into(buf, offset, header)
+        if header != size:
+            buf[offset] = 0
+            offset += 1
+        if data is not None:
+            self._size = offset + size
+            buf[offset:self._size] = data
+        elif pkt_id < 0x80:
+            buf[offset] = pkt_id
+            self._size = pkt.emit_into(buf, offset + 1)
+        else:
+            self._size = pkt.emit_into(buf, pack_varint_into(buf, offset, pkt_id))
+
+    def getvalue(self):
+        return str(buffer(self._buffer, 0, self._size))
+
+    def view(self):
+        return memoryview(self._buffer)[:self._size]
+
+    def clear(self):
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
 def read_varint(b):
     byte = b.read(1)
     if not byte:
@@ -106,17 +319,23 @@ def read_varint(b):
         value, shift = value + ((quantum & 0x7f) << shift), shift + 7
         if not quantum & 0x80:
             break
+    if value > 0x7FFFFFFF: # 32 bit two's complement
+        value -= 0x100000000
     return value
 def write_varint(b, value):
-    if value <= 127: # fast path
+    if 0 <= value <= 127: # fast path
         b.write(chr(value))
     else:
+        if value < 0: # encoded as 32 bit two's complement
+            value &= 0xFFFFFFFF
         shifted_value = True # dummy initialized
         while shifted_value:
             shifted_value = value >> 7
             b.write(chr((value & 0x7f) | (0x80 if shifted_value else 0)))
             value = shifted_value
 def size_varint(value):
+    if value < 0:
+        value &= 0xFFFFFFFF
     size = 1
     while value & ~0x7f:
         size += 1
@@ -135,10 +354,9 @@ def write_position(b, pos):
     write_ubyte(b, pos.y)
     write_int(b, pos.z)
 
-def read_position_packed(b):
+def _decode_position_packed(p):
     # most retarded protocol encoding ever to save
     # a few bytes in a data type that's rarly used.
-    p = read_ulong(b)
     def twentysix_bit_2_complement(v):
         if v & 0x2000000:
             v = v - (1 << 26)
@@ -148,8 +366,13 @@ def read_position_packed(b):
         (p >> 26) & 0xfff, 
         twentysix_bit_2_complement(p & 0x3ffffff)
     )
+def _encode_position_packed(pos):
+    return (pos.x & 0x3ffffff) << 38 | pos.y << 26 | pos.z & 0x3ffffff
+
+def read_position_packed(b):
+    return _decode_position_packed(read_ulong(b))
 def write_position_packed(b, pos):
-    write_ulong(b, (pos.x & 0x3ffffff) << 38 | pos.y << 26 | pos.z & 0x3ffffff)
+    write_ulong(b, _encode_position_packed(pos))
 
 def read_short_string(b):
     size = read_short(b)
@@ -782,149 +1005,582 @@ class NbtTag(namedtuple('NbtTag', 'tag_type value')):
 NbtList = namedtuple('NbtList', 'tag_type values')
 NBT = namedtuple('NBT', 'name root')
 
-def read_nbt(b):
-    def read_nbt_byte_array(b):
-        length = read_int(b)
-        return array('b', unpack(">%db" % length, b.read(length)))
-    def read_nbt_int_array(b):
-        length = read_int(b)
-        return array('i', unpack(">%di" % length, b.read(length * 4)))
-    def read_nbt_list(b):
-        tag_type = read_byte(b)
-        decoder = TAG_TYPES[tag_type]
-        length = read_int(b)
-        return NbtList(tag_type, [decoder(b) for _ in xrange(length)])
-    def read_nbt_compound(b):
-        out = {}
-        while 1:
-            name, nbt_tag = read_nbt_tag(b)
-            if nbt_tag.tag_type == NbtTag.END:
-                break
-            out[name] = nbt_tag
-        return out
-    def read_nbt_tag(b):
-        tag_type = read_byte(b)
-        if tag_type == NbtTag.END:
-            name = ""
-            value = None
-        else:
+# The NBT codec uses module level dispatch tables. Compounds and lists
+# are decoded without recursion and lists of fixed size primitives are
+# decoded and encoded with a single struct call.
+
+# Byte and int array tags are decoded to array.array by default. With
+# FASTMC_NBT_NUMPY set they are decoded to numpy arrays instead. Both
+# are converted from and to their big endian encoding in bulk, as are
+# numpy arrays passed to write_nbt.
+if os.getenv("FASTMC_NBT_NUMPY"):
+    import numpy
+else:
+    numpy = None
+
+_SWAP_INT_ARRAY = sys.byteorder == "little"
+assert array('i').itemsize == 4
+
+def _read_array_data(b, size):
+    data = b.read(size)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if len(data) != size:
+        raise ValueError("truncated nbt array")
+    return data
+
+def _read_nbt_byte_array(b):
+    data = _read_array_data(b, read_int(b))
+    if numpy is not None:
+        return numpy.frombuffer(data, numpy.int8).copy()
+    return array('b', data)
+def _write_nbt_byte_array(b, values):
+    write_int(b, len(values))
+    if isinstance(values, array) and values.typecode == 'b':
+        b.write(values.tostring())
+    elif numpy is not None and isinstance(values, numpy.ndarray):
+        b.write(values.astype(numpy.int8).tostring())
+    else:
+        b.write(array('b', values).tostring())
+
+def _read_nbt_int_array(b):
+    data = _read_array_data(b, read_int(b) * 4)
+    if numpy is not None:
+        return numpy.frombuffer(data, ">i4").astype(numpy.int32)
+    values = array('i', data)
+    if _SWAP_INT_ARRAY:
+        values.byteswap()
+    return values
+def _write_nbt_int_array(b, values):
+    write_int(b, len(values))
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        b.write(values.astype(">i4").tostring())
+        return
+    if isinstance(values, array) and values.typecode == 'i':
+        if not _SWAP_INT_ARRAY:
+            b.write(values.tostring())
+            return
+        values = values[:]
+    else:
+        values = array('i', values)
+    if _SWAP_INT_ARRAY:
+        values.byteswap()
+    b.write(values.tostring())
+
+# Tags that don't contain other tags
+_NBT_READERS = {
+    NbtTag.END: lambda b: None,
+    NbtTag.BYTE: read_byte,
+    NbtTag.SHORT: read_short,
+    NbtTag.INT: read_int,
+    NbtTag.LONG: read_long,
+    NbtTag.FLOAT: read_float,
+    NbtTag.DOUBLE: read_double,
+    NbtTag.BYTE_ARRAY: _read_nbt_byte_array,
+    NbtTag.STRING: read_short_string,
+    NbtTag.INT_ARRAY: _read_nbt_int_array,
+}
+_NBT_WRITERS = {
+    NbtTag.END: lambda b, value: None,
+    NbtTag.BYTE: write_byte,
+    NbtTag.SHORT: write_short,
+    NbtTag.INT: write_int,
+    NbtTag.LONG: write_long,
+    NbtTag.FLOAT: write_float,
+    NbtTag.DOUBLE: write_double,
+    NbtTag.BYTE_ARRAY: _write_nbt_byte_array,
+    NbtTag.STRING: write_short_string,
+    NbtTag.INT_ARRAY: _write_nbt_int_array,
+}
+
+# struct format and size of list elements that can be handled in bulk
+_NBT_BULK = {
+    NbtTag.BYTE: ("b", 1),
+    NbtTag.SHORT: ("h", 2),
+    NbtTag.INT: ("i", 4),
+    NbtTag.LONG: ("q", 8),
+    NbtTag.FLOAT: ("f", 4),
+    NbtTag.DOUBLE: ("d", 8),
+}
+
+_NBT_HEADER = Struct(">bi")
+
+def _read_nbt_list_header(b, stack):
+    # Returns a new NbtList. Lists of compounds or lists are returned
+    # empty and pushed to the stack to be filled by _read_nbt_nested.
+    tag_type, length = _NBT_HEADER.unpack(b.read(5))
+    if length <= 0:
+        return NbtList(tag_type, [])
+    bulk = _NBT_BULK.get(tag_type)
+    if bulk is not None:
+        code, size = bulk
+        return NbtList(tag_type, list(unpack(">%d%s" % (length, code), b.read(length * size))))
+    reader = _NBT_READERS.get(tag_type)
+    if reader is not None:
+        return NbtList(tag_type, [reader(b) for _ in xrange(length)])
+    values = []
+    stack.append((values, tag_type, length))
+    return NbtList(tag_type, values)
+
+def _read_nbt_nested(b, tag_type):
+    # Decodes a compound or list. Each stack entry is a container that
+    # is still being filled: (dict, None, None) for compounds and
+    # (values, element tag type, length) for lists.
+    stack = []
+    if tag_type == NbtTag.COMPOUND:
+        root = {}
+        stack.append((root, None, None))
+    elif tag_type == NbtTag.LIST:
+        root = _read_nbt_list_header(b, stack)
+    else:
+        raise ValueError("invalid nbt tag type %d" % tag_type)
+    readers = _NBT_READERS
+    while stack:
+        container, element_type, length = stack[-1]
+        if element_type is None:
+            tag_type = read_byte(b)
+            if tag_type == NbtTag.END:
+                stack.pop()
+                continue
             name = read_short_string(b)
-            value = TAG_TYPES[tag_type](b)
-        return name, NbtTag(tag_type, value)
-    TAG_TYPES = {
-        NbtTag.END: lambda b: None,
-        NbtTag.BYTE: read_byte,
-        NbtTag.SHORT: read_short,
-        NbtTag.INT: read_int,
-        NbtTag.LONG: read_long,
-        NbtTag.FLOAT: read_float,
-        NbtTag.DOUBLE: read_double,
-        NbtTag.BYTE_ARRAY: read_nbt_byte_array,
-        NbtTag.STRING: read_short_string,
-        NbtTag.LIST: read_nbt_list,
-        NbtTag.COMPOUND: read_nbt_compound,
-        NbtTag.INT_ARRAY: read_nbt_int_array,
-    }
-    name, nbt_tag = read_nbt_tag(b)
-    # assert nbt_tag.tag_type == NbtTag.COMPOUND
-    return NBT(name, nbt_tag)
+        else:
+            if len(container) == length:
+                stack.pop()
+                continue
+            tag_type = element_type
+        reader = readers.get(tag_type)
+        if reader is not None:
+            value = reader(b)
+        elif tag_type == NbtTag.COMPOUND:
+            value = {}
+            stack.append((value, None, None))
+        elif tag_type == NbtTag.LIST:
+            value = _read_nbt_list_header(b, stack)
+        else:
+            raise ValueError("invalid nbt tag type %d" % tag_type)
+        if element_type is None:
+            container[name] = NbtTag(tag_type, value)
+        else:
+            container.append(value)
+    return root
 
-def write_nbt(b, nbt):
-    def write_nbt_byte_array(b, values):
-        write_int(b, len(values))
-        b.write(pack(">%db" % len(values), *values))
-    def write_nbt_int_array(b, values):
-        write_int(b, len(values))
-        b.write(pack(">%di" % len(values), *values))
-    def write_nbt_list(b, nbt_list):
-        write_byte(b, nbt_list.tag_type)
-        write_int(b, len(nbt_list.values))
-        encoder = TAG_TYPES[nbt_list.tag_type]
-        for value in nbt_list.values:
-            encoder(b, value)
-    def write_nbt_compound(b, values):
-        for name, nbt_tag in values.iteritems():
-            write_nbt_tag(b, name, nbt_tag)
-        write_byte(b, NbtTag.END)
-    def write_nbt_tag(b, name, nbt_tag):
-        assert nbt_tag.tag_type != NbtTag.END
-        write_byte(b, nbt_tag.tag_type)
+def read_nbt(b):
+    tag_type = read_byte(b)
+    if tag_type == NbtTag.END:
+        return NBT("", NbtTag(NbtTag.END, None))
+    name = read_short_string(b)
+    reader = _NBT_READERS.get(tag_type)
+    if reader is not None:
+        value = reader(b)
+    else:
+        value = _read_nbt_nested(b, tag_type)
+    # assert tag_type == NbtTag.COMPOUND
+    return NBT(name, NbtTag(tag_type, value))
+
+def _write_nbt_list(b, nbt_list):
+    tag_type, values = nbt_list
+    b.write(_NBT_HEADER.pack(tag_type, len(values)))
+    bulk = _NBT_BULK.get(tag_type)
+    if bulk is not None:
+        if values:
+            b.write(pack(">%d%s" % (len(values), bulk[0]), *values))
+        return
+    writer = _NBT_WRITERS[tag_type]
+    for value in values:
+        writer(b, value)
+
+def _write_nbt_compound(b, values):
+    writers = _NBT_WRITERS
+    write = b.write
+    for name, (tag_type, value) in values.iteritems():
+        assert tag_type != NbtTag.END
+        write(chr(tag_type))
         write_short_string(b, name)
-        TAG_TYPES[nbt_tag.tag_type](b, nbt_tag.value)
-    TAG_TYPES = {
-        NbtTag.END: lambda b: None,
-        NbtTag.BYTE: write_byte,
-        NbtTag.SHORT: write_short,
-        NbtTag.INT: write_int,
-        NbtTag.LONG: write_long,
-        NbtTag.FLOAT: write_float,
-        NbtTag.DOUBLE: write_double,
-        NbtTag.BYTE_ARRAY: write_nbt_byte_array,
-        NbtTag.STRING: write_short_string,
-        NbtTag.LIST: write_nbt_list,
-        NbtTag.COMPOUND: write_nbt_compound,
-        NbtTag.INT_ARRAY: write_nbt_int_array,
-    }
-    write_nbt_tag(b, nbt.name, nbt.root)
+        writers[tag_type](b, value)
+    write("\x00")
+
+_NBT_WRITERS[NbtTag.LIST] = _write_nbt_list
+_NBT_WRITERS[NbtTag.COMPOUND] = _write_nbt_compound
+
+def write_nbt(b, nbt):
+    tag_type, value = nbt.root
+    assert tag_type != NbtTag.END
+    write_byte(b, tag_type)
+    write_short_string(b, nbt.name)
+    _NBT_WRITERS[tag_type](b, value)
+
+def decode_frame(frame, compression_threshold, compression_policy=None):
+    # Frames read from a ByteArrayReadBuffer are memoryviews that are
+    # only valid until the next append. The returned raw data is kept
+    # by callers (e.g. as pkt_raw), so it must not wrap the view.
+    if isinstance(frame, memoryview):
+        frame = frame.tobytes()
+    raw = StringIO(frame)
+    if compression_threshold is None:
+        return raw
+    data_length = read_varint(raw)
+    if data_length == 0: # uncompressed
+        if len(frame) - raw.tell() >= compression_threshold:
+            raise ValueError("packet is uncompressed despite being larger than %d" % compression_threshold)
+        return raw
+    else:
+        if compression_policy is None:
+            decompressed = raw.read().decode('zlib')
+        else:
+            decompressed = compression_policy.decompress(raw.read(), data_length)
+        if len(decompressed) != data_length:
+            raise ValueError("decompressed length doesn't match server values")
+        if len(decompressed) < compression_threshold:
+            raise ValueError("packet was compressed but data was smaller than %d" % compression_threshold)
+        return StringIO(decompressed)
+
+def unpack_varint(data, offset):
+    # varint decoding from a string or memoryview at the given offset.
+    # Returns the value and the offset following the varint.
+    value = shift = 0
+    while 1:
+        byte = ord(data[offset])
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            if value > 0x7FFFFFFF: # 32 bit two's complement
+                value -= 0x100000000
+            return value, offset
+        shift += 7
+
+# Offset based readers used by the generated parse_from methods. They
+# take a string or memoryview and an offset and return the value and
+# the offset following it.
+
+_SHORT = Struct(">h")
+
+def _slice(data, start, end):
+    chunk = data[start:end]
+    if isinstance(chunk, memoryview):
+        return chunk.tobytes()
+    return chunk
+
+def unpack_string(data, offset):
+    size, offset = unpack_varint(data, offset)
+    return _slice(data, offset, offset + size).decode("utf8"), offset + size
+
+def unpack_json(data, offset):
+    value, offset = unpack_string(data, offset)
+    return json_loads(value), offset
+
+def unpack_varint_byte_array(data, offset):
+    size, offset = unpack_varint(data, offset)
+    return _slice(data, offset, offset + size), offset + size
+
+def unpack_short_byte_array(data, offset):
+    size = max(_SHORT.unpack_from(data, offset)[0], 0)
+    offset += 2
+    return _slice(data, offset, offset + size), offset + size
+
+def unpack_short_string(data, offset):
+    value, offset = unpack_short_byte_array(data, offset)
+    return value.decode("utf8"), offset
+
+def unpack_bytes_exhaustive(data, offset):
+    return _slice(data, offset, len(data)), len(data)
+
+# Counterparts used by the generated size and emit_into methods. The
+# size_ functions return the encoded size of a value, the pack_*_into
+# functions encode a value into a bytearray at the given offset and
+# return the offset following it. The bytearray must already be large
+# enough.
+
+def pack_varint_into(buf, offset, value):
+    if value < 0:
+        value &= 0xFFFFFFFF
+    while value & ~0x7f:
+        buf[offset] = (value & 0x7f) | 0x80
+        offset += 1
+        value >>= 7
+    buf[offset] = value
+    return offset + 1
+
+def _pack_bytes_into(buf, offset, data):
+    end = offset + len(data)
+    # slice assignment would silently grow the bytearray
+    if end > len(buf):
+        raise ValueError("buffer too small")
+    buf[offset:end] = data
+    return end
+
+def size_string(value):
+    size = len(value.encode("utf8"))
+    return size_varint(size) + size
+
+def pack_string_into(buf, offset, value):
+    encoded = value.encode("utf8")
+    offset = pack_varint_into(buf, offset, len(encoded))
+    return _pack_bytes_into(buf, offset, encoded)
+
+def size_varint_byte_array(value):
+    return size_varint(len(value)) + len(value)
+
+def pack_varint_byte_array_into(buf, offset, value):
+    offset = pack_varint_into(buf, offset, len(value))
+    return _pack_bytes_into(buf, offset, value)
+
+def size_short_byte_array(value):
+    return 2 + len(value)
+
+def pack_short_byte_array_into(buf, offset, value):
+    _SHORT.pack_into(buf, offset, len(value))
+    return _pack_bytes_into(buf, offset + 2, value)
+
+def size_short_string(value):
+    return 2 + len(value.encode("utf8"))
+
+def pack_short_string_into(buf, offset, value):
+    return pack_short_byte_array_into(buf, offset, value.encode("utf8"))
+
+def size_bytes_exhaustive(value):
+    return len(value)
+
+def pack_bytes_exhaustive_into(buf, offset, value):
+    return _pack_bytes_into(buf, offset, value)
+
+def _encode(writer, value):
+    # Fallback for types without size_/pack_*_into functions
+    out = StringIO()
+    writer(out, value)
+    return out.getvalue()
+
+def peek_packet_id(frame, compression_threshold):
+    # Returns the id of the packet contained in frame without decoding
+    # the frame. Compressed frames are only inflated up to the id.
+    if compression_threshold is None:
+        return unpack_varint(frame, 0)[0]
+    data_length, offset = unpack_varint(frame, 0)
+    if data_length == 0:
+        return unpack_varint(frame, offset)[0]
+    for size in (256, len(frame)):
+        head = frame[offset:offset + size]
+        if not isinstance(head, str):
+            head = head.tobytes()
+        try:
+            return unpack_varint(zlib.decompressobj().decompress(head, 5), 0)[0]
+        except IndexError:
+            pass
+    raise ValueError("cannot decode packet id")
 
 def read_raw(b, compression_threshold):
     ss = b.snapshot()
-    pkt_size = read_varint(b)
+    pkt_size = b.read_varint()
     if pkt_size is None:
         b.restore(ss)
         return None
+    frame = b.read(pkt_size)
+    if len(frame) != pkt_size:
+        b.restore(ss)
+        return None
+    return decode_frame(frame, compression_threshold)
+
+PACKET_PARSE = 0
+PACKET_RAW = 1
+PACKET_DROP = 2
+
+# Packets that change the state, compression or encryption of the
+# connection. Packet filters always parse them, as the stream can't be
+# decoded correctly if the consumer doesn't see them.
+FILTER_REQUIRED_PACKETS = frozenset([
+    "Handshake",
+    "EncryptionRequest",
+    "EncryptionResponse",
+    "LoginSuccess",
+    "SetCompression",
+])
+
+RawPacket = namedtuple("RawPacket", "id data")
+
+class FrameReader(object):
+    # Incremental alternative to read_raw: Only compares the length of
+    # the next frame against the bytes available in the buffer, so a
+    # large frame arriving in many small reads is neither copied nor
+    # rescanned until it is complete. An incomplete frame is left in
+    # the buffer, header included, so the buffer can still be used with
+    # snapshot/restore, read_raw or another reader in between.
+    __slots__ = [
+        "_needed",
+    ]
+
+    def __init__(self):
+        self._needed = 0
+
+    def bytes_needed(self):
+        # number of bytes still missing to complete the current frame.
+        # Only an estimate (1) if the frame length isn't known yet.
+        return self._needed
 
-    if compression_threshold is not None:
-        data_length = read_varint(b)
-        if data_length is None:
+    def read_frame(self, b):
+        ss = b.snapshot()
+        pkt_size = b.read_varint()
+        if pkt_size is None:
             b.restore(ss)
+            self._needed = 1
             return None
-
-        data_size = pkt_size - size_varint(data_length)
-        data = b.read(data_size)
-        if len(data) != data_size:
+        available = b.available()
+        if available < pkt_size:
             b.restore(ss)
+            self._needed = pkt_size - available
             return None
+        self._needed = 0
+        return b.read(pkt_size)
 
-        if data_length == 0: # uncompressed
-            if len(data) >= compression_threshold:
-                raise ValueError("packet is uncompressed despite being larger than %d" % compression_threshold)
-            return StringIO(data)
-        else:
-            decompressed = data.decode('zlib')
-            if len(decompressed) != data_length:
-                raise ValueError("decompressed length doesn't match server values")
-            if len(decompressed) < compression_threshold:
-                raise ValueError("packet was compressed but data was smaller than %d" % compression_threshold)
-            return StringIO(decompressed)
-    else:
-        data = b.read(pkt_size)
-        if len(data) != pkt_size:
-            b.restore(ss)
+    def read(self, b, compression_threshold, compression_policy=None):
+        frame = self.read_frame(b)
+        if frame is None:
             return None
-        return StringIO(data)
+        return decode_frame(frame, compression_threshold, compression_policy)
+
+CompressionStats = namedtuple("CompressionStats", "count cpu_time bytes_in bytes_out")
+
+def _make_thread_cpu_time():
+    # High resolution CPU time of the calling thread through
+    # clock_gettime(CLOCK_THREAD_CPUTIME_ID). Where that isn't available,
+    # wall time is returned instead, which includes time spent waiting
+    # for the GIL or the CPU.
+    try:
+        import ctypes
+        import ctypes.util
+        clock_gettime = ctypes.CDLL(ctypes.util.find_library("c")).clock_gettime
+    except (ImportError, OSError, AttributeError):
+        return time.time
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+    clock_id = 16 if sys.platform == "darwin" else 3
+    def thread_cpu_time():
+        ts = timespec()
+        clock_gettime(clock_id, ctypes.byref(ts))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    if clock_gettime(clock_id, ctypes.byref(timespec())) != 0:
+        return time.time
+    return thread_cpu_time
+
+thread_cpu_time = _make_thread_cpu_time()
+
+class CompressionPolicy(object):
+    # Chooses the zlib level per packet id (e.g. fast levels for entity
+    # metadata, high levels for chunk data that is sent only once) and
+    # records the cpu time spent and the bytes saved per packet id.
+    # Reading endpoints with a policy decompress through it as well.
+    #
+    # Each frame has to be a complete zlib stream and Python's zlib
+    # module can't reset a compressor, so there is no compressor state
+    # to reuse between frames: zlib.compress is faster than copying a
+    # prepared compressobj.
+    def __init__(self, default_level=6, levels=None, collect_stats=True):
+        self._default_level = default_level
+        self._levels = dict(levels or {})
+        self._collect_stats = collect_stats
+        self._stats = {}
+
+    def set_level(self, pkt_id, level):
+        self._levels[pkt_id] = level
+
+    def get_level(self, pkt_id):
+        return self._levels.get(pkt_id, self._default_level)
+
+    def compress(self, pkt_id, data):
+        level = self._levels.get(pkt_id, self._default_level)
+        if not self._collect_stats:
+            return zlib.compress(data, level)
+        start = thread_cpu_time()
+        compressed = zlib.compress(data, level)
+        self._record(pkt_id, thread_cpu_time() - start, len(data), len(compressed))
+        return compressed
+
+    def decompress(self, data, size):
+        return zlib.decompress(data)
+
+    def _record(self, pkt_id, cpu_time, bytes_in, bytes_out):
+        stats = self._stats.get(pkt_id)
+        if stats is None:
+            stats = self._stats[pkt_id] = [0, 0.0, 0, 0]
+        stats[0] += 1
+        stats[1] += cpu_time
+        stats[2] += bytes_in
+        stats[3] += bytes_out
+
+    def stats(self):
+        return dict(
+            (pkt_id, CompressionStats(*stats))
+            for pkt_id, stats in self._stats.iteritems()
+        )
 
-def write_packet(b, pkt, compression_threshold):
-    raw = StringIO()
-    write_varint(raw, pkt.id)
-    pkt.emit(raw)
-    size = raw.tell()
+    def reset_stats(self):
+        self._stats.clear()
+
+def write_frame(b, data, compression_threshold, compression_policy=None):
+    size = len(data)
     if compression_threshold is None:
         write_varint(b, size)
-        b.write(raw.getvalue())
+        b.write(data)
     elif size >= compression_threshold:
-        data = raw.getvalue()
-        compressed = data.encode('zlib')
-        write_varint(b, size_varint(len(data)) + len(compressed))
-        write_varint(b, len(data))
+        if compression_policy is None:
+            compressed = data.encode('zlib')
+        else:
+            compressed = compression_policy.compress(unpack_varint(data, 0)[0], data)
+        write_varint(b, size_varint(size) + len(compressed))
+        write_varint(b, size)
         b.write(compressed)
     else:
-        data = raw.getvalue()
-        data_size = size_varint(0) + len(data)
+        data_size = size_varint(0) + size
         write_varint(b, data_size)
         write_varint(b, 0)
         b.write(data)
 
+def write_packet(b, pkt, compression_threshold, compression_policy=None):
+    raw = StringIO()
+    write_varint(raw, pkt.id)
+    pkt.emit(raw)
+    write_frame(b, raw.getvalue(), compression_threshold, compression_policy)
+
+class PreparedFrame(object):
+    # A packet that is sent to many connections (chat, time updates,
+    # entity movement). The packet is encoded once per protocol version
+    # and framed/compressed once per compression threshold. The
+    # resulting frames can be written to any number of buffers using
+    # Endpoint.write_prepared. Only encryption is left per connection.
+    __slots__ = [
+        "_pkt_id",
+        "_data",
+        "_state",
+        "_side",
+        "_compression_policy",
+        "_payloads",
+        "_frames",
+    ]
+
+    def __init__(self, pkt_id, data, state=None, side=None, compression_policy=None):
+        self._pkt_id = pkt_id
+        self._data = data
+        self._compression_policy = compression_policy
+        self._state = PLAY if state is None else state
+        self._side = CLIENTBOUND if side is None else side
+        self._payloads = {}
+        self._frames = {}
+
+    def get(self, protocol_version, compression_threshold):
+        key = protocol_version, compression_threshold
+        frame = self._frames.get(key)
+        if frame is None:
+            payload = self._payloads.get(protocol_version)
+            if payload is None:
+                packet = ProtocolVersion[protocol_version].get_packets(
+                    self._state, self._side)[self._pkt_id]
+                raw = StringIO()
+                write_varint(raw, self._pkt_id)
+                packet.create(**self._data).emit(raw)
+                payload = self._payloads[protocol_version] = raw.getvalue()
+            out = StringIO()
+            write_frame(out, payload, compression_threshold, self._compression_policy)
+            frame = self._frames[key] = out.getvalue()
+        return frame
+
 PROTOCOL_LINE = re.compile(r"(\w+)\s+(\w+)(?:\s+(.*))?").match
 PRIMITIVES = {
     'byte':     ('b', 1, None,          None),
@@ -940,7 +1596,53 @@ PRIMITIVES = {
     'int32':    ('i', 4, "%s / 32.0",   "int(%s * 32)"),
     'byte32':   ('b', 1, "%s / 32.0",   "int(%s * 32)"),
 }
-def make_packet_type(protocol_version, pkt_id, pkt_name, desc):
+
+# fixed size composites, which are unpacked as part of a struct run:
+# parser -> (struct format, size, read template, write templates)
+COMPOSITES = {
+    'position':         ('iBi', 9,  "Position(%s, %s, %s)",
+                                    ("%s.x", "%s.y", "%s.z")),
+    'position_packed':  ('Q',   8,  "_decode_position_packed(%s)",
+                                    ("_encode_position_packed(%s)",)),
+    'uuid':             ('QQ',  16, "%s << 64 | %s",
+                                    ("%s >> 64", "%s & 0xffffffffffffffff")),
+    'vector':           ('iii', 12, "Vector(%s, %s, %s)",
+                                    ("%s.x", "%s.y", "%s.z")),
+    'rotation':         ('fff', 12, "Rotation(%s, %s, %s)",
+                                    ("%s.pitch", "%s.roll", "%s.yaw")),
+}
+_VARINT2 = Struct(">BB")
+_VARINT2_PACK = _VARINT2.pack
+_VARINT2_PACK_INTO = _VARINT2.pack_into
+
+# Module level names used by all generated packet code
+PACKET_GLOBALS = (
+    'Struct',
+    'StringIO',
+    'Position',
+    'Vector',
+    'Rotation',
+    '_decode_position_packed',
+    '_encode_position_packed',
+    '_VARINT2_PACK',
+    '_VARINT2_PACK_INTO',
+    'write_varint',
+    'size_varint',
+    'pack_varint_into',
+    '_pack_bytes_into',
+    '_encode',
+)
+
+def fixed_field(parser):
+    if parser in PRIMITIVES:
+        primitive, size, read_mod, write_mod = PRIMITIVES[parser]
+        return primitive, size, read_mod or "%s", (write_mod or "%s",)
+    return COMPOSITES.get(parser)
+
+def generate_packet_code(protocol_version, pkt_id, pkt_name, desc, class_name=None, prefix=""):
+    # Returns the source of the packet class and the module level
+    # functions it uses. prefix is added to the names of module level
+    # constants, so the code of many packets can share a module.
     def parse_fields():
         for line in desc.split("\n"):
             line = line.strip()
@@ -961,28 +1663,150 @@ def make_packet_type(protocol_version, pkt_id, pkt_name, desc):
         def get(self):
             return "\n".join(self._code)
 
+    # Consecutive fixed size fields sharing the same condition are
+    # combined into a single Struct run.
     def primitives_optimizer(fields):
         parts = []
-        run, run_size = [], 0
+        run, run_size, run_condition = [], 0, None
         for name, parser, condition in fields:
-            if OPTIMIZE and parser in PRIMITIVES and not condition:
-                primitive, size, read_mod, write_mod = PRIMITIVES[parser]
-                run.append((name, primitive, read_mod, write_mod))
-                run_size += size
-            elif run:
-                names, primitives, read_mods, write_mods = izip(*run)
-                fmt = ">%s" % "".join(primitive for primitive in primitives)
-                parts.append((True, (fmt, run_size, names, read_mods, write_mods)))
+            info = fixed_field(parser) if OPTIMIZE else None
+            if run and (info is None or condition != run_condition):
+                fmt = ">%s" % "".join(item[0] for name_, item in run)
+                parts.append((True, (fmt, run_size, run_condition, run)))
                 run, run_size = [], 0
-                parts.append((False, (name, parser, condition)))
+            if info is not None:
+                run.append((name, info))
+                run_size += info[1]
+                run_condition = condition
             else:
                 parts.append((False, (name, parser, condition)))
         if run:
-            names, primitives, read_mods, write_mods = izip(*run)
-            fmt = ">%s" % "".join(primitive for primitive in primitives)
-            parts.append((True, (fmt, run_size, names, read_mods, write_mods)))
+            fmt = ">%s" % "".join(item[0] for name_, item in run)
+            parts.append((True, (fmt, run_size, run_condition, run)))
         return parts
 
+    # varints are decoded and encoded by generated code instead of
+    # calls to read_varint/write_varint. Nearly all values fit in one
+    # or two bytes. Like read_varint, truncated input results in None
+    # and values are decoded as 32 bit two's complement.
+    # Offset based code raises IndexError, like unpack_varint.
+    def inline_read_varint(target, next_byte):
+        if offset_based:
+            code.add("_c = ord(%s)" % next_byte)
+            code.add("offset += 1")
+        else:
+            # None > 127 is false, so the value ends up being None
+            code.add("_c = %s" % next_byte)
+            code.add("_c = ord(_c) if _c else None")
+        code.add("if _c > 127:")
+        code.indent()
+        code.add("_v, _s = _c & 0x7f, 7")
+        code.add("while 1:")
+        code.indent()
+        if offset_based:
+            code.add("_c = ord(%s)" % next_byte)
+            code.add("offset += 1")
+        else:
+            code.add("_c = %s" % next_byte)
+            code.add("if not _c:")
+            code.add("  _v = None")
+            code.add("  break")
+            code.add("_c = ord(_c)")
+        code.add("_v |= (_c & 0x7f) << _s")
+        code.add("if _c < 128: break")
+        code.add("_s += 7")
+        code.dedent()
+        code.add("if _v > 0x7FFFFFFF: _v -= 0x100000000")
+        code.add("_c = _v")
+        code.dedent()
+        code.add("%s = _c" % target)
+
+    def inline_write_varint(source):
+        code.add("_v = %s" % source)
+        code.add("if 0 <= _v < 0x80:")
+        code.add("  write(chr(_v))")
+        code.add("elif 0 < _v < 0x4000:")
+        code.add("  write(_VARINT2_PACK(_v & 0x7f | 0x80, _v >> 7))")
+        code.add("else:")
+        code.add("  write_varint(b, _v)")
+
+    def inline_pack_varint(source):
+        code.add("_v = %s" % source)
+        code.add("if 0 <= _v < 0x80:")
+        code.add("  buf[offset] = _v")
+        code.add("  offset += 1")
+        code.add("elif 0 < _v < 0x4000:")
+        code.add("  _VARINT2_PACK_INTO(buf, offset, _v & 0x7f | 0x80, _v >> 7)")
+        code.add("  offset += 2")
+        code.add("else:")
+        code.add("  offset = pack_varint_into(buf, offset, _v)")
+
+    def run_args(run):
+        # fields encoded as several values are bound to a local first
+        args = []
+        for name, (_, _, _, write_templates) in run:
+            source = "self.%s" % name
+            if len(write_templates) > 1:
+                code.add("_f_%s = %s" % (name, source))
+                source = "_f_%s" % name
+            args.extend(template % source for template in write_templates)
+        return args
+
+    def read_run(run_idx, size, run, source):
+        # unpacks directly into the attributes where possible, into
+        # locals for fields that need a conversion
+        targets, conversions = [], []
+        for name, (fmt, _, read_template, _) in run:
+            if read_template == "%s":
+                targets.append("self.%s" % name)
+                continue
+            values = ["_%d" % (len(targets) + n) for n in xrange(len(fmt))]
+            targets.extend(values)
+            conversions.append((name, read_template % tuple(values)))
+        code.add("%s, = %s_RUN_%d_%s" % (", ".join(targets), prefix, run_idx, source))
+        for name, value in conversions:
+            code.add("self.%s = %s" % (name, value))
+
+    def read_field(name, parser):
+        if offset_based:
+            if INLINE_VARINT and parser == 'varint':
+                inline_read_varint("self.%s" % name, "data[offset]")
+            elif 'unpack_%s' % parser in globals():
+                code.add("self.%s, offset = unpack_%s(data, offset)" % (name, parser))
+            else:
+                code.add("_b = StringIO(data)")
+                code.add("_b.seek(offset)")
+                code.add("self.%s = read_%s(_b)" % (name, parser))
+                code.add("offset = _b.tell()")
+        elif INLINE_VARINT and parser == 'varint':
+            inline_read_varint("self.%s" % name, "read(1)")
+        else:
+            code.add("self.%s = read_%s(b)" % (name, parser))
+
+    def add_parser():
+        for run_idx, (is_optimized, info) in enumerate(optimized):
+            if is_optimized:
+                fmt, size, condition, run = info
+                names = [name for name, _ in run]
+            else:
+                name, parser, condition = info
+                names = [name]
+            if condition:
+                code.add("if %s:" % condition)
+                code.indent()
+            if not is_optimized:
+                read_field(name, parser)
+            elif offset_based:
+                read_run(run_idx, size, run, "UNPACK_FROM(data, offset)")
+                code.add("offset += %d" % size)
+            else:
+                read_run(run_idx, size, run, "UNPACK(read(%d))" % size)
+            if condition:
+                code.dedent()
+                code.add("else:")
+                for name in names:
+                    code.add("  self.%s = None" % name)
+
     fields = list(parse_fields())
     optimized = primitives_optimizer(fields)
 
@@ -990,17 +1814,23 @@ def make_packet_type(protocol_version, pkt_id, pkt_name, desc):
 
     for run_idx, (is_optimized, info) in enumerate(optimized):
         if is_optimized:
-            fmt, size, names, read_mods, _ = info
+            fmt = info[0]
             code.add("_tmp = Struct('%s')" % fmt)
-            code.add("_RUN_%d_PACK, _RUN_%d_UNPACK = _tmp.pack, _tmp.unpack" % (
-                run_idx, run_idx))
+            code.add("%s_RUN_%d_PACK, %s_RUN_%d_UNPACK, %s_RUN_%d_UNPACK_FROM = _tmp.pack, _tmp.unpack, _tmp.unpack_from" % (
+                prefix, run_idx, prefix, run_idx, prefix, run_idx))
+            code.add("%s_RUN_%d_PACK_INTO = _tmp.pack_into" % (prefix, run_idx))
 
-    code.add("class %s(object):" % pkt_name) 
+    code.add("class %s(object):" % (class_name or pkt_name))
     code.indent()
     if fields:
         code.add("__slots__ = %s" % (
             ", ".join('"%s"' % name for name, parser, condition in fields)))
     code.add("id = %s" % pkt_id)
+    code.add("_fields = %r" % (tuple(fields),))
+    # True if size() doesn't have to encode any of the fields
+    code.add("_sized = %r" % all(
+        is_optimized or info[1] == 'varint' or 'size_%s' % info[1] in globals()
+        for is_optimized, info in optimized))
 
     code.add("@classmethod")
     signature = ["cls"]
@@ -1022,30 +1852,10 @@ def make_packet_type(protocol_version, pkt_id, pkt_name, desc):
     code.add("def parse(cls, b):")
     code.indent()
     code.add("self = cls()")
-    for run_idx, (is_optimized, info) in enumerate(optimized):
-        if is_optimized:
-            fmt, size, names, read_mods, _ = info
-            code.add("(%s,) = _RUN_%d_UNPACK(b.read(%d))" % (
-                ", ".join("self.%s" % name for name in names),
-                run_idx,
-                size
-            ))
-            for name, mod in izip(names, read_mods):
-                if mod:
-                    code.add("self.%s = %s" % (
-                        name, 
-                        mod % ("self.%s" % name)
-                    ))
-        else:
-            name, parser, condition = info
-            if condition:
-                code.add("if %s:" % condition)
-                code.add("  self.%s = read_%s(b)" % (name, parser))
-                code.add("else:")
-                code.add("  self.%s = None" % name)
-            else:
-                code.add("self.%s = read_%s(b)" % (name, parser))
-
+    if fields:
+        code.add("read = b.read")
+    offset_based = False
+    add_parser()
     if DEBUG_PACKET:
         code.add("remaining = len(b.read())")
         code.add("assert not remaining, 'WARNING: %d unread bytes in 0x%02x' % (remaining, self.id)")
@@ -1053,36 +1863,96 @@ def make_packet_type(protocol_version, pkt_id, pkt_name, desc):
     code.add("return self")
     code.dedent()
 
+    # Parses the packet from a string (or memoryview) starting at
+    # offset. Returns the packet and the offset following it.
+    code.add("@classmethod")
+    code.add("def parse_from(cls, data, offset):")
+    code.indent()
+    code.add("self = cls()")
+    offset_based = True
+    add_parser()
+    code.add("return self, offset")
+    code.dedent()
+
     code.add("def emit(self, b):")
     code.indent()
+    if fields:
+        code.add("write = b.write")
     for run_idx, (is_optimized, info) in enumerate(optimized):
         if is_optimized:
-            fmt, size, names, _, write_mods = info
-            emit_names = []
-            for name, mod in izip(names, write_mods):
-                if mod:
-                    code.add("%s = %s" % (
-                        name, 
-                        mod % ("self.%s" % name)
-                    ))
-                    emit_names.append(name)
-                else:
-                    emit_names.append("self.%s" % name)
-            code.add("b.write(_RUN_%d_PACK(%s))" % (
-                run_idx,
-                ", ".join(emit_names)
-            ))
+            fmt, size, condition, run = info
         else:
             name, parser, condition = info
-            if condition:
-                code.add("if %s:" % condition)
-                code.add("  write_%s(b, self.%s)" % (parser, name))
-            else:
-                code.add("write_%s(b, self.%s)" % (parser, name))
+        if condition:
+            code.add("if %s:" % condition)
+            code.indent()
+        if is_optimized:
+            code.add("write(%s_RUN_%d_PACK(%s))" % (prefix, run_idx, ", ".join(run_args(run))))
+        elif INLINE_VARINT and parser == 'varint':
+            inline_write_varint("self.%s" % name)
+        else:
+            code.add("write_%s(b, self.%s)" % (parser, name))
+        if condition:
+            code.dedent()
     if not optimized:
         code.add("pass")
     code.dedent()
 
+    # Size of the encoded fields. Used together with emit_into to
+    # encode a packet directly into a preallocated bytearray.
+    code.add("def size(self):")
+    code.indent()
+    code.add("size = %d" % sum(
+        info[1] for is_optimized, info in optimized
+        if is_optimized and not info[2]))
+    for is_optimized, info in optimized:
+        if is_optimized:
+            fmt, size, condition, run = info
+            if condition:
+                code.add("if %s: size += %d" % (condition, size))
+            continue
+        name, parser, condition = info
+        if condition:
+            code.add("if %s:" % condition)
+            code.indent()
+        if parser == 'varint':
+            code.add("_v = self.%s" % name)
+            code.add("size += 1 if 0 <= _v < 0x80 else size_varint(_v)")
+        elif 'size_%s' % parser in globals():
+            code.add("size += size_%s(self.%s)" % (parser, name))
+        else:
+            code.add("size += len(_encode(write_%s, self.%s))" % (parser, name))
+        if condition:
+            code.dedent()
+    code.add("return size")
+    code.dedent()
+
+    # Encodes the fields into the bytearray buf starting at offset.
+    # Returns the offset following the packet.
+    code.add("def emit_into(self, buf, offset):")
+    code.indent()
+    for run_idx, (is_optimized, info) in enumerate(optimized):
+        if is_optimized:
+            fmt, size, condition, run = info
+        else:
+            name, parser, condition = info
+        if condition:
+            code.add("if %s:" % condition)
+            code.indent()
+        if is_optimized:
+            code.add("%s_RUN_%d_PACK_INTO(buf, offset, %s)" % (prefix, run_idx, ", ".join(run_args(run))))
+            code.add("offset += %d" % size)
+        elif INLINE_VARINT and parser == 'varint':
+            inline_pack_varint("self.%s" % name)
+        elif 'pack_%s_into' % parser in globals():
+            code.add("offset = pack_%s_into(buf, offset, self.%s)" % (parser, name))
+        else:
+            code.add("offset = _pack_bytes_into(buf, offset, _encode(write_%s, self.%s))" % (parser, name))
+        if condition:
+            code.dedent()
+    code.add("return offset")
+    code.dedent()
+
     code.add("@classmethod")
     code.add("def desc(cls):")
     code.indent()
@@ -1108,21 +1978,159 @@ def make_packet_type(protocol_version, pkt_id, pkt_name, desc):
             for num, line in enumerate(code.get().split("\n")))
         print
 
-    compiled = compile(code.get(), "%s:%s(0x%x)@%d" % (__file__, pkt_name, pkt_id, protocol_version), 'exec')
-
-    env = {
-        'Struct': Struct
-    }
+    # module level functions used by the generated code
+    helpers = []
     for run_idx, (is_optimized, info) in enumerate(optimized):
         if not is_optimized:
             name, parser, condition = info
-            for mode in ('read', 'write'):
-                env['%s_%s' % (mode, parser)] = globals()['%s_%s' % (mode, parser)]
+            for func in ('read_%s', 'write_%s', 'unpack_%s', 'size_%s', 'pack_%s_into'):
+                func = func % parser
+                if func in globals():
+                    helpers.append(func)
+    return code.get(), tuple(helpers)
+
+def compile_packet_type(protocol_version, pkt_id, pkt_name, desc):
+    source, helpers = generate_packet_code(protocol_version, pkt_id, pkt_name, desc)
+    compiled = compile(source, "%s:%s(0x%x)@%d" % (__file__, pkt_name, pkt_id, protocol_version), 'exec')
+    return compiled, helpers
+
+def make_packet_type(protocol_version, pkt_id, pkt_name, desc):
+    cached = key = None
+    if CODE_CACHE is not None:
+        key = codecache.make_key(protocol_version, pkt_id, pkt_name, desc)
+        cached = CODE_CACHE.get(key)
+    if cached is None:
+        cached = compile_packet_type(protocol_version, pkt_id, pkt_name, desc)
+        if key is not None:
+            CODE_CACHE.put(key, cached)
+    compiled, helpers = cached
+
+    env = dict((name, globals()[name]) for name in PACKET_GLOBALS + helpers)
 
     exec compiled in env
     return env[pkt_name]
 
 
+def skip_string(b):
+    b.seek(read_varint(b), 1)
+skip_json = skip_string
+skip_varint_byte_array = skip_string
+
+def skip_short_byte_array(b):
+    b.seek(max(read_short(b), 0), 1)
+skip_short_string = skip_short_byte_array
+
+def skip_int_byte_array(b):
+    b.seek(max(read_int(b), 0), 1)
+
+def skip_bytes_exhaustive(b):
+    b.seek(0, 2)
+
+SKIP_SIZES = dict((name, info[1]) for name, info in PRIMITIVES.iteritems())
+SKIP_SIZES.update({
+    'position':         9,
+    'position_packed':  8,
+    'uuid':             16,
+    'vector':           12,
+    'rotation':         12,
+})
+
+class _LazyField(object):
+    __slots__ = [
+        "index",
+        "name",
+        "reader",
+        "size",
+        "skip",
+        "condition",
+    ]
+
+    def __init__(self, index, name, parser, condition):
+        self.index = index
+        self.name = name
+        self.reader = globals()['read_%s' % parser]
+        self.size = SKIP_SIZES.get(parser)
+        self.skip = globals().get('skip_%s' % parser)
+        self.condition = eval("lambda self: %s" % condition) if condition else None
+
+    def __get__(self, pkt, cls):
+        if pkt is None:
+            return self
+        values = pkt._values
+        if self.name in values:
+            return values[self.name]
+        return pkt._decode(self.index)
+
+    def __set__(self, pkt, value):
+        pkt._values[self.name] = value
+
+class LazyPacket(object):
+    # Mixin for packet types generated by lazy_packet_type. Parsing
+    # only keeps a copy of the packet data. Fields are decoded on first
+    # access. Offsets of the fields are found by skipping over all
+    # preceding fields, which is cheap for fixed size and length
+    # prefixed fields. Other fields are decoded (and kept) on the way.
+    __slots__ = ()
+
+    def __init__(self):
+        self._values = {}
+        self._offsets = None
+
+    @classmethod
+    def parse(cls, b):
+        self = cls()
+        self._b = StringIO(b.read())
+        self._offsets = [0]
+        return self
+
+    def _decode(self, index):
+        b, values, offsets = self._b, self._values, self._offsets
+        lazy_fields = self._lazy_fields
+        while len(offsets) <= index:
+            field = lazy_fields[len(offsets) - 1]
+            start = offsets[-1]
+            if field.condition and not field.condition(self):
+                values.setdefault(field.name, None)
+                offsets.append(start)
+            elif field.size is not None:
+                offsets.append(start + field.size)
+            else:
+                b.seek(start, 0)
+                if field.skip is not None:
+                    field.skip(b)
+                else:
+                    values.setdefault(field.name, field.reader(b))
+                offsets.append(b.tell())
+
+        field = lazy_fields[index]
+        if field.name not in values:
+            if field.condition and not field.condition(self):
+                values[field.name] = None
+            else:
+                b.seek(offsets[index], 0)
+                values[field.name] = field.reader(b)
+                if len(offsets) == index + 1:
+                    offsets.append(b.tell())
+        return values[field.name]
+
+_lazy_packet_types = {}
+
+def lazy_packet_type(packet):
+    lazy = _lazy_packet_types.get(packet)
+    if lazy is None:
+        lazy_fields = []
+        attrs = {
+            '__slots__': ("_b", "_offsets", "_values"),
+            '_lazy_fields': lazy_fields,
+        }
+        for index, (name, parser, condition) in enumerate(packet._fields):
+            field = _LazyField(index, name, parser, condition)
+            lazy_fields.append(field)
+            attrs[name] = field
+        lazy = _lazy_packet_types[packet] = type(packet.__name__, (LazyPacket, packet), attrs)
+    return lazy
+
+
 ProtocolVersion = {}
 
 
@@ -1132,18 +2140,111 @@ def protocol(protocol_version):
     return ProtocolVersion[protocol_version]
 
 
+# Packet types by the protocol version defining them and their
+# definition. Protocols based on another one share its packet types.
+_packet_types = {}
+
+def get_packet_type(protocol_version, state, side, pkt_id, pkt_name, desc):
+    key = protocol_version, state, side, pkt_id, pkt_name, desc
+    packet = _packet_types.get(key)
+    if packet is None:
+        packet = _packet_types[key] = make_packet_type(protocol_version, pkt_id, pkt_name, desc)
+    return packet
+
+GENERATED_PACKAGE = "fastmc.generated"
+
+def definitions_key(definitions):
+    return codecache.make_key(sorted(definitions.iteritems()))
+
+def load_generated(protocol_version, definitions):
+    # Returns the module generated by fastmc.aot for the protocol
+    # version, None if there is none or it is outdated.
+    name = "%s.protocol_%d" % (GENERATED_PACKAGE, protocol_version)
+    try:
+        module = __import__(name, fromlist=["PACKETS"])
+    except ImportError:
+        return None
+    if module.CODE_TAG != CODE_TAG or module.DEFINITIONS != definitions_key(definitions):
+        log.warning("ignoring outdated generated module %s" % name)
+        return None
+    return module
+
 class Protocol(object):
+    # Packet definitions are only recorded when the protocol is
+    # defined. The packet types are generated when the protocol is used
+    # for the first time. Protocols it is based on are not built, only
+    # the packets inherited from them. Startup time and memory only grow
+    # with the versions (and packets) actually used.
     def __init__(self, protocol_version):
         self._protocol_version = protocol_version
         self._name = None
         self._states = {} # state, side, pkt_id
+        self._definitions = [] # (based on version,) or (state, side, pkt_id, pkt_name, desc)
+        self._built = False
+        self._building = False
+
+    def definitions(self):
+        # Returns all packet definitions including inherited ones as a
+        # dict (state, side, pkt_id) -> (defining version, pkt_name, desc)
+        definitions = {}
+        for definition in self._definitions:
+            if len(definition) == 1:
+                definitions.update(ProtocolVersion[definition[0]].definitions())
+            else:
+                state, side, pkt_id, pkt_name, desc = definition
+                definitions[state, side, pkt_id] = self._protocol_version, pkt_name, desc
+        return definitions
+
+    def _build(self):
+        # _building guards against recursion (e.g. through __getattr__)
+        # while the packets are added. _built is only set once all of
+        # them were added, so a failed build is retried on next access.
+        if self._built or self._building:
+            return
+        self._building = True
+        try:
+            self._add_packets()
+            self._built = True
+        except:
+            self._states = {}
+            raise
+        finally:
+            self._building = False
+        if CODE_CACHE is not None:
+            CODE_CACHE.save()
+
+    def _add_packets(self):
+        definitions = self.definitions()
+        generated = load_generated(self._protocol_version, definitions) if USE_GENERATED else None
+        if generated is not None:
+            log.debug("loading protocol %d from %s" % (self._protocol_version, generated.__name__))
+            for state, sides in generated.PACKETS.iteritems():
+                for side, packets in enumerate(sides):
+                    for packet in packets.itervalues():
+                        self._add_packet(state, side, packet)
+            return
+        log.debug("building protocol %d" % self._protocol_version)
+        for (state, side, pkt_id), (version, pkt_name, desc) in definitions.iteritems():
+            self._add_packet(state, side,
+                get_packet_type(version, state, side, pkt_id, pkt_name, desc))
+
+    @property
+    def built(self):
+        return self._built
 
     def based_on(self, other_protocol_version):
-        other_protocol = ProtocolVersion[other_protocol_version]
-        for state, sides in other_protocol._states.iteritems():
-            for side, packets in enumerate(sides):
-                for packet in packets.itervalues():
-                    self.add_packet(state, side, packet)
+        self._definitions.append((other_protocol_version,))
+        if self._built:
+            for (state, side, pkt_id), (version, pkt_name, desc) in \
+                    ProtocolVersion[other_protocol_version].definitions().iteritems():
+                self._add_packet(state, side,
+                    get_packet_type(version, state, side, pkt_id, pkt_name, desc))
+
+    def define_packet(self, state, side, pkt_id, pkt_name, desc=""):
+        self._definitions.append((state, side, pkt_id, pkt_name, desc))
+        if self._built:
+            self._add_packet(state, side, get_packet_type(
+                self._protocol_version, state, side, pkt_id, pkt_name, desc))
 
     def set_name(self, name):
         self._name = name
@@ -1157,19 +2258,34 @@ class Protocol(object):
         return self._name
 
     def get_packets(self, state, side):
+        if not self._built:
+            self._build()
         return self._states[state][side]
 
     def add_packet(self, state, side, packet):
+        self._build()
+        self._add_packet(state, side, packet)
+
+    def _add_packet(self, state, side, packet):
         # log.debug("adding state %d, side %d, packet %d to protocol %d" % (
         #     state, side, packet.id, self._protocol_version))
         self._states.setdefault(state, [{}, {}])[side][packet.id] = packet
         name = "%s%s%s" % (STATES[state], SIDES[side], packet.__name__)
         setattr(self, name, packet)
 
+    def __getattr__(self, name):
+        # packet types are available as attributes named like
+        # PlayClientboundKeepAlive once the protocol is built
+        if name.startswith("_") or self._built or self._building:
+            raise AttributeError(name)
+        self._build()
+        return getattr(self, name)
+
     def state(self, state):
         return _State(self, state)
 
     def __str__(self):
+        self._build()
         return "# protocol %d (%s)\n\n%s\n" % (
             self._protocol_version, self._name,
             "\n".join("- STATE %s:\n=================\n\n%s" % (
@@ -1204,34 +2320,37 @@ class _Side(object):
         self._side = side
 
     def __call__(self, pkt_id, pkt_name, desc=""):
-        self._protocol.add_packet(self._state, self._side, 
-            make_packet_type(self._protocol.version, pkt_id, pkt_name, desc))
+        self._protocol.define_packet(self._state, self._side, pkt_id, pkt_name, desc)
 
 
 class Endpoint(object):
     @classmethod
-    def client_pair(cls, protocol_version):
-        return cls.from_server(protocol_version), cls.to_server(protocol_version)
+    def client_pair(cls, protocol_version, lazy=False):
+        return cls.from_server(protocol_version, lazy), cls.to_server(protocol_version)
 
     @classmethod
-    def server_pair(cls, protocol_version):
-        return cls.from_client(protocol_version), cls.to_client(protocol_version)
+    def server_pair(cls, protocol_version, lazy=False):
+        return cls.from_client(protocol_version, lazy), cls.to_client(protocol_version)
 
     @classmethod
-    def from_server(cls, protocol_version):
-        return cls(protocol_version, CLIENTBOUND)
+    def from_server(cls, protocol_version, lazy=False):
+        return cls(protocol_version, CLIENTBOUND, lazy)
 
     @classmethod
-    def from_client(cls, protocol_version):
-        return cls(protocol_version, SERVERBOUND)
+    def from_client(cls, protocol_version, lazy=False):
+        return cls(protocol_version, SERVERBOUND, lazy)
 
     to_client = from_server 
     to_server = from_client
 
-    def __init__(self, protocol_version, side):
+    def __init__(self, protocol_version, side, lazy=False):
         self._side = side
         self._protocol = ProtocolVersion[protocol_version]
+        self._lazy = lazy
         self._compression_threshold = None
+        self._compression_policy = None
+        self._frames = FrameReader()
+        self._packet_filters = {}
         self.switch_state(HANDSHAKE)
 
     @property
@@ -1251,42 +2370,207 @@ class Endpoint(object):
             compression_threshold = None
         self._compression_threshold = compression_threshold
 
+    @property
+    def compression_policy(self):
+        return self._compression_policy
+
+    def set_compression_policy(self, compression_policy):
+        self._compression_policy = compression_policy
+
     def switch_state(self, state):
         self._state = state
         self._state_packets = self._protocol.get_packets(state, self._side)
+        if self._lazy:
+            self._state_packets = dict(
+                (pkt_id, lazy_packet_type(packet))
+                for pkt_id, packet in self._state_packets.iteritems()
+            )
+        self._packet_filter = self._packet_filters.get(state)
         log.debug("endpoint switch to state %d" % (self._state))
 
+    def set_packet_filter(self, policy, default=PACKET_DROP, state=None):
+        # Selects which packets are parsed while in the given state
+        # (PLAY by default). policy is either an iterable of interesting
+        # packet ids or a dict mapping packet ids to PACKET_PARSE,
+        # PACKET_RAW or PACKET_DROP. Packets not mentioned get the
+        # default policy. Dropped packets are skipped by read. Raw
+        # packets are returned as RawPacket tuples. None removes the
+        # filter. Packets in FILTER_REQUIRED_PACKETS are always parsed.
+        if state is None:
+            state = PLAY
+        if policy is None:
+            self._packet_filters.pop(state, None)
+        else:
+            if isinstance(policy, dict):
+                policy = dict(policy)
+            else:
+                policy = dict.fromkeys(policy, PACKET_PARSE)
+            for pkt_id, packet in self._protocol.get_packets(state, self._side).iteritems():
+                if packet.__name__ in FILTER_REQUIRED_PACKETS:
+                    policy[pkt_id] = PACKET_PARSE
+            self._packet_filters[state] = policy, default
+        if state == self._state:
+            self._packet_filter = self._packet_filters.get(state)
+
+    def bytes_needed(self):
+        return self._frames.bytes_needed()
+
     def read(self, buf):
-        raw = read_raw(buf, self._compression_threshold)
+        # Returns the next complete packet in buf as (pkt, raw) or
+        # (None, None) if buf doesn't contain a complete frame yet. An
+        # incomplete frame isn't consumed: Append more data to the same
+        # buffer and call read again.
+        if self._packet_filter is not None:
+            return self._read_filtered(buf)
+        raw = self._frames.read(buf, self._compression_threshold, self._compression_policy)
         if raw is None:
             return None, None
         pkt_id = read_varint(raw)
         # log.debug("received pkt id %d in state %d" % (pkt_id, self._state))
         return self._state_packets[pkt_id].parse(raw), raw
 
+    def _read_filtered(self, buf):
+        policy, default = self._packet_filter
+        compression_threshold = self._compression_threshold
+        read_frame = self._frames.read_frame
+        while 1:
+            frame = read_frame(buf)
+            if frame is None:
+                return None, None
+            action = policy.get(peek_packet_id(frame, compression_threshold), default)
+            if action == PACKET_DROP:
+                continue
+            raw = decode_frame(frame, compression_threshold, self._compression_policy)
+            pkt_id = read_varint(raw)
+            if action == PACKET_RAW:
+                return RawPacket(pkt_id, raw.read()), raw
+            return self._state_packets[pkt_id].parse(raw), raw
+
+    def iter_read(self, buf, with_raw=False):
+        # Yields all complete packets in buf (as (pkt, raw) tuples if
+        # with_raw is set). State or compression changes made by the
+        # consumer while iterating apply to the following packets.
+        read_frame = self._frames.read_frame
+        while 1:
+            if self._packet_filter is not None:
+                pkt, raw = self._read_filtered(buf)
+                if pkt is None:
+                    return
+                yield (pkt, raw) if with_raw else pkt
+                continue
+            frame = read_frame(buf)
+            if frame is None:
+                return
+            raw = decode_frame(frame, self._compression_threshold, self._compression_policy)
+            pkt = self._state_packets[read_varint(raw)].parse(raw)
+            yield (pkt, raw) if with_raw else pkt
+
+    def read_all(self, buf, with_raw=False):
+        # Decodes all complete packets in buf in a single pass and
+        # returns them together with the number of bytes consumed.
+        # Only whole frames are consumed; a trailing incomplete frame
+        # stays in buf and isn't included in that count.
+        # The whole batch is decoded using the current state and
+        # compression threshold, so use iter_read while those might
+        # still change (handshake, login).
+        read_frame = self._frames.read_frame
+        compression_threshold = self._compression_threshold
+        compression_policy = self._compression_policy
+        state_packets = self._state_packets
+        available = buf.available()
+        out = []
+        append = out.append
+        if self._packet_filter is not None:
+            read_filtered = self._read_filtered
+            while 1:
+                pkt, raw = read_filtered(buf)
+                if pkt is None:
+                    break
+                append((pkt, raw) if with_raw else pkt)
+            return out, available - buf.available()
+        # Uncompressed frames are parsed in place using parse_from unless
+        # the raw data was requested. Lazy packets have to keep their
+        # raw data, so they always take the decode_frame path.
+        in_place = not with_raw and not self._lazy
+        while 1:
+            frame = read_frame(buf)
+            if frame is None:
+                break
+            if in_place:
+                if compression_threshold is None:
+                    data_length, offset = 0, 0
+                else:
+                    data_length, offset = unpack_varint(frame, 0)
+                    if data_length == 0 and len(frame) - offset >= compression_threshold:
+                        raise ValueError("packet is uncompressed despite being larger than %d" % compression_threshold)
+                if data_length == 0:
+                    pkt_id, offset = unpack_varint(frame, offset)
+                    append(state_packets[pkt_id].parse_from(frame, offset)[0])
+                    continue
+            raw = decode_frame(frame, compression_threshold, compression_policy)
+            pkt = state_packets[read_varint(raw)].parse(raw)
+            append((pkt, raw) if with_raw else pkt)
+        return out, available - buf.available()
+
     def write(self, buf, pkt_id, **data):
         # log.debug("sending pkt id %d %r" % (pkt_id, data))
         self.write_pkt(buf, self._state_packets[pkt_id].create(**data))
 
     def write_pkt(self, buf, pkt):
-        write_packet(buf, pkt, self._compression_threshold)
+        if type(buf) is ByteArrayWriteBuffer:
+            buf.write_packet(pkt, self._compression_threshold, self._compression_policy)
+        else:
+            write_packet(buf, pkt, self._compression_threshold, self._compression_policy)
+
+    def write_prepared(self, buf, frame):
+        buf.write(frame.get(self._protocol.version, self._compression_threshold))
 
 class MinecraftSocket(object):
-    def __init__(self, sock):
+    def __init__(self, sock, recv_size=4096, max_recv_size=262144):
         self._sock = sock
         self._sock_send = sock.sendall
         self._sock_recv = sock.recv
+        self._sock_recv_into = sock.recv_into
         self._encrypt = None
         self._decrypt = None
+        self._decrypt_into = None
+
+        # preallocated receive arena for recv_into. It doubles in size
+        # (up to max_recv_size) whenever a single read fills it up.
+        self._recv_arena = bytearray(recv_size)
+        self._recv_view = memoryview(self._recv_arena)
+        self._max_recv_size = max(recv_size, max_recv_size)
 
         self._sent = 0
         self._received = 0
+        self._recv_calls = 0
 
     def set_cipher(self, send_cipher, recv_cipher):
         self._encrypt = send_cipher.encrypt
         self._decrypt = recv_cipher.decrypt
+        # cipher backends able to decrypt a writable buffer in place
+        # provide decrypt_into. Others return a decrypted copy.
+        self._decrypt_into = getattr(recv_cipher, "decrypt_into", None)
         log.debug("set send/recv cipher")
 
+    @property
+    def sent(self):
+        return self._sent
+
+    @property
+    def received(self):
+        return self._received
+
+    @property
+    def recv_calls(self):
+        return self._recv_calls
+
+    @property
+    def recv_calls_per_mb(self):
+        if not self._received:
+            return 0.0
+        return self._recv_calls * 1048576.0 / self._received
+
     def send(self, buf):
         data = buf.getvalue()
         # print "sending ", data
@@ -1297,6 +2581,7 @@ class MinecraftSocket(object):
 
     def recv(self):
         data = self._sock_recv(4096)
+        self._recv_calls += 1
         if not data:
             return ""
         if self._decrypt:
@@ -1304,6 +2589,38 @@ class MinecraftSocket(object):
         self._received += len(data)
         return data
 
+    def recv_into(self, buf, size_hint=0):
+        # Receives into the preallocated arena and appends the
+        # (decrypted) data to the given read buffer. Returns the
+        # number of bytes received, 0 once the connection is closed.
+        # size_hint (see Endpoint.bytes_needed) grows the arena, so
+        # large frames can be received with fewer calls.
+        if size_hint > len(self._recv_arena):
+            self.set_recv_size(size_hint)
+        view = self._recv_view
+        size = self._sock_recv_into(view)
+        self._recv_calls += 1
+        if not size:
+            return 0
+        if self._decrypt_into:
+            self._decrypt_into(view[:size])
+            buf.append(view[:size])
+        elif self._decrypt:
+            buf.append(self._decrypt(buffer(self._recv_arena, 0, size)))
+        else:
+            buf.append(view[:size])
+        self._received += size
+        if size == len(view) and size < self._max_recv_size:
+            self.set_recv_size(size * 2)
+        return size
+
+    def set_recv_size(self, recv_size):
+        recv_size = min(recv_size, self._max_recv_size)
+        if recv_size > len(self._recv_arena):
+            log.debug("growing receive arena to %d bytes" % recv_size)
+            self._recv_arena = bytearray(recv_size)
+            self._recv_view = memoryview(self._recv_arena)
+
     def settimeout(self, timeout):
         self._sock.settimeout(timeout)
 
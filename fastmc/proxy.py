@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+
+from fastmc.proto import (
+    ByteArrayReadBuffer,
+    WriteBuffer,
+    FrameReader,
+    ProtocolVersion,
+    decode_frame,
+    peek_packet_id,
+    read_varint,
+    write_varint,
+    write_frame,
+    write_packet,
+    CLIENTBOUND,
+    SERVERBOUND,
+    HANDSHAKE,
+    LOGIN,
+    PLAY,
+)
+
+log = logging.getLogger(__name__)
+
+class PassthroughProxy(object):
+    # Forwards opaque frames between a client and a server connection
+    # (both MinecraftSockets) without parsing them. Only the packets
+    # changing the connection state or compression are decoded:
+    #
+    #   Handshake       switches to the requested state
+    #   LoginSuccess    switches to PLAY
+    #   SetCompression  changes the compression threshold
+    #
+    # Frames are forwarded byte-for-byte (including compressed payloads)
+    # as long as both sides use the same compression threshold. Setting
+    # client_threshold announces a different threshold to the client.
+    # Frames are then recompressed for the other side.
+    #
+    # Only offline mode servers are supported: The proxy doesn't take
+    # part in the encryption handshake, so an EncryptionRequest from
+    # the server raises a ValueError.
+    #
+    # Run pump_client_to_server and pump_server_to_client concurrently
+    # (e.g. in two greenlets). Each returns once its source is closed.
+
+    def __init__(self, client_sock, server_sock, protocol_version,
+                 state=HANDSHAKE, compression_threshold=None, client_threshold=None):
+        self._client_sock = client_sock
+        self._server_sock = server_sock
+        self._protocol = ProtocolVersion[protocol_version]
+        self._state = state
+        self._client_threshold_override = client_threshold
+        self._server_threshold = compression_threshold
+        self._client_threshold = compression_threshold
+        if client_threshold is not None and compression_threshold is not None:
+            self._client_threshold = client_threshold
+
+        self._trackers = {}
+        self._add_tracker(HANDSHAKE, SERVERBOUND, "Handshake", self._on_handshake)
+        self._add_tracker(LOGIN, CLIENTBOUND, "EncryptionRequest", self._on_encryption_request)
+        self._add_tracker(LOGIN, CLIENTBOUND, "LoginSuccess", self._on_login_success)
+        self._add_tracker(LOGIN, CLIENTBOUND, "SetCompression", self._on_set_compression)
+        self._add_tracker(PLAY, CLIENTBOUND, "SetCompression", self._on_set_compression)
+
+        self.forwarded = 0
+        self.reencoded = 0
+
+    def _add_tracker(self, state, side, name, handler):
+        for packet in self._protocol.get_packets(state, side).itervalues():
+            if packet.__name__ == name:
+                self._trackers[state, side, packet.id] = packet, handler
+
+    @property
+    def state(self):
+        return self._state
+
+    def _on_handshake(self, pkt):
+        log.debug("proxy switch to state %d" % pkt.state)
+        self._state = pkt.state
+
+    def _on_encryption_request(self, pkt):
+        raise ValueError("server requested encryption, only offline mode is supported")
+
+    def _on_login_success(self, pkt):
+        log.debug("proxy switch to state %d" % PLAY)
+        self._state = PLAY
+
+    def _on_set_compression(self, pkt):
+        threshold = pkt.threshold if pkt.threshold != -1 else None
+        self._server_threshold = self._client_threshold = threshold
+        override = self._client_threshold_override
+        if threshold is None or override is None:
+            return None
+        self._client_threshold = override
+        return pkt.create(threshold=override)
+
+    def pump_client_to_server(self):
+        self._pump(self._client_sock, self._server_sock, SERVERBOUND)
+
+    def pump_server_to_client(self):
+        self._pump(self._server_sock, self._client_sock, CLIENTBOUND)
+
+    def _pump(self, src, dst, side):
+        buf = ByteArrayReadBuffer()
+        frames = FrameReader()
+        read_frame = frames.read_frame
+        forward = self._forward
+        while 1:
+            if not src.recv_into(buf, frames.bytes_needed()):
+                break
+            out = WriteBuffer()
+            while 1:
+                frame = read_frame(buf)
+                if frame is None:
+                    break
+                forward(frame, side, out)
+            if out.tell():
+                dst.send(out)
+        log.debug("proxy source closed (side %d)" % side)
+
+    def _forward(self, frame, side, out):
+        if side == CLIENTBOUND:
+            src_threshold, dst_threshold = self._server_threshold, self._client_threshold
+        else:
+            src_threshold, dst_threshold = self._client_threshold, self._server_threshold
+
+        replacement = None
+        tracker = self._trackers.get((self._state, side, peek_packet_id(frame, src_threshold)))
+        if tracker is not None:
+            packet, handler = tracker
+            raw = decode_frame(frame, src_threshold)
+            read_varint(raw)
+            replacement = handler(packet.parse(raw))
+
+        if replacement is not None:
+            write_packet(out, replacement, dst_threshold)
+            self.reencoded += 1
+        elif src_threshold == dst_threshold:
+            write_varint(out, len(frame))
+            out.write(frame)
+            self.forwarded += 1
+        else:
+            raw = decode_frame(frame, src_threshold)
+            write_frame(out, raw.read(), dst_threshold)
+            self.reencoded += 1
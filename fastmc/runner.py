@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Multi process server runner: Forks a number of worker processes that
+# all accept connections on the same port using SO_REUSEPORT, so the
+# kernel distributes incoming connections between them. Each worker
+# runs a gevent StreamServer calling handler(sock, addr) for every
+# connection.
+#
+# The master process restarts crashed workers. SIGHUP replaces all
+# workers one by one: the new worker is started before the old one
+# stops accepting and gets graceful_timeout seconds to finish its
+# connections. A SIGHUP received while old workers are still stopping
+# restarts once they are gone. SIGTERM/SIGINT stop all workers.
+#
+# Workers that die shortly after being started are restarted with an
+# increasing delay, so a crashing handler doesn't make the master fork
+# in a tight loop.
+
+import os
+import time
+import errno
+import signal
+import socket
+import logging
+from multiprocessing.sharedctypes import RawArray
+
+from Crypto import Random
+
+log = logging.getLogger(__name__)
+
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", 15)
+
+STAT_FIELDS = "pid", "connections", "active", "errors", "packets"
+
+SHUTDOWN_SIGNALS = signal.SIGTERM, signal.SIGINT
+
+# Workers running shorter than MIN_UPTIME seconds count as crashing.
+# Their replacements are delayed, doubling up to MAX_RESPAWN_DELAY.
+MIN_UPTIME = 5
+MIN_RESPAWN_DELAY = 0.5
+MAX_RESPAWN_DELAY = 30
+
+class WorkerStats(object):
+    # Counters of a single worker in memory shared with the master
+    def __init__(self, array, slot):
+        self._array = array
+        self._base = slot * len(STAT_FIELDS)
+
+    def reset(self, pid):
+        for idx in xrange(len(STAT_FIELDS)):
+            self._array[self._base + idx] = 0
+        self._array[self._base] = pid
+
+    def incr(self, name, amount=1):
+        self._array[self._base + STAT_FIELDS.index(name)] += amount
+
+    def get(self):
+        return dict(
+            (name, self._array[self._base + idx])
+            for idx, name in enumerate(STAT_FIELDS)
+        )
+
+class ServerRunner(object):
+    def __init__(self, handler, address, workers=None, backlog=1024,
+                 graceful_timeout=30, stats_interval=60):
+        self._handler = handler
+        self._address = address
+        self._num_workers = workers or os.sysconf("SC_NPROCESSORS_ONLN")
+        self._backlog = backlog
+        self._graceful_timeout = graceful_timeout
+        self._stats_interval = stats_interval
+
+        # Twice the slots, so replacement workers can start while
+        # the old ones are still shutting down.
+        num_slots = self._num_workers * 2
+        self._stats_array = RawArray('l', num_slots * len(STAT_FIELDS))
+        self._free_slots = range(num_slots)
+        self._workers = {} # pid -> slot
+        self._stopping = {} # pid -> slot
+        self._started = {} # pid -> start time
+        self._respawns = [] # start times of replacement workers
+        self._respawn_delay = 0
+        self._restart_pending = False
+        self._signal = None
+
+        # set inside of a worker process
+        self.stats = None
+
+    def listen(self, socket_module=socket):
+        sock = socket_module.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        sock.bind(self._address)
+        sock.listen(self._backlog)
+        return sock
+
+    def get_stats(self):
+        return [
+            WorkerStats(self._stats_array, slot).get()
+            for slot in sorted(self._workers.values())
+        ]
+
+    def _spawn(self):
+        slot = self._free_slots.pop(0)
+        stats = WorkerStats(self._stats_array, slot)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                # pycrypto's RNG refuses to run in a forked child
+                # until it is reinitialized
+                Random.atfork()
+                stats.reset(os.getpid())
+                self.stats = stats
+                self._run_worker()
+            except:
+                log.exception("worker failed")
+                code = 1
+            finally:
+                os._exit(code)
+        self._workers[pid] = slot
+        self._started[pid] = time.time()
+        log.info("started worker %d" % pid)
+        return pid
+
+    def _run_worker(self):
+        # The master decides when workers stop
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        import gevent
+        import gevent.socket
+        from gevent.server import StreamServer
+
+        stats = self.stats
+        handler = self._handler
+        def handle(sock, addr):
+            stats.incr("connections")
+            stats.incr("active")
+            try:
+                handler(sock, addr)
+            except Exception:
+                stats.incr("errors")
+                log.exception("handler failed")
+            finally:
+                stats.incr("active", -1)
+                sock.close()
+
+        server = StreamServer(self.listen(gevent.socket), handle)
+        gevent.signal_handler(signal.SIGTERM,
+            lambda: gevent.spawn(server.stop, self._graceful_timeout))
+        server.serve_forever()
+
+    def _reap(self):
+        while 1:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, err:
+                if err.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            if pid in self._stopping:
+                self._free_slots.append(self._stopping.pop(pid))
+                log.info("worker %d stopped" % pid)
+            elif pid in self._workers:
+                self._free_slots.append(self._workers.pop(pid))
+                if time.time() - self._started.pop(pid) < MIN_UPTIME:
+                    self._respawn_delay = min(max(
+                        self._respawn_delay * 2, MIN_RESPAWN_DELAY
+                    ), MAX_RESPAWN_DELAY)
+                else:
+                    self._respawn_delay = 0
+                log.warning("worker %d died (status %d), restarting in %.1fs" % (
+                    pid, status, self._respawn_delay))
+                if self._signal not in SHUTDOWN_SIGNALS:
+                    self._respawns.append(time.time() + self._respawn_delay)
+                    self._respawns.sort()
+
+    def _respawn(self):
+        now = time.time()
+        while self._respawns and self._respawns[0] <= now and self._free_slots:
+            self._respawns.pop(0)
+            self._spawn()
+
+    def _stop_worker(self, pid, signum=signal.SIGTERM):
+        self._stopping[pid] = self._workers.pop(pid)
+        self._started.pop(pid, None)
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+
+    def restart(self):
+        # Replace workers one by one. There are only enough slots for
+        # one generation of stopping workers, so if the previous ones
+        # are still stopping, the restart happens once they are gone.
+        if self._stopping:
+            log.info("previous workers still stopping, restarting later")
+            self._restart_pending = True
+            return
+        self._restart_pending = False
+        for pid in list(self._workers):
+            self._spawn()
+            self._stop_worker(pid)
+
+    def _on_signal(self, signum, frame):
+        self._signal = signum
+
+    def run(self):
+        # make sure the address can be bound before forking
+        self.listen().close()
+
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+
+        for n in xrange(self._num_workers):
+            self._spawn()
+
+        next_stats = time.time() + self._stats_interval
+        while 1:
+            time.sleep(0.5)
+            self._reap()
+
+            signum, self._signal = self._signal, None
+            if signum in SHUTDOWN_SIGNALS:
+                log.info("stopping workers")
+                for pid in list(self._workers):
+                    self._stop_worker(pid)
+                break
+            if signum == signal.SIGHUP or (self._restart_pending and not self._stopping):
+                log.info("restarting workers")
+                self.restart()
+
+            self._respawn()
+
+            if time.time() > next_stats:
+                next_stats = time.time() + self._stats_interval
+                for stats in self.get_stats():
+                    log.info("worker %(pid)d: %(connections)d connections, "
+                             "%(active)d active, %(errors)d errors, "
+                             "%(packets)d packets" % stats)
+
+        deadline = time.time() + self._graceful_timeout + 5
+        while self._stopping and time.time() < deadline:
+            time.sleep(0.1)
+            self._reap()
+        for pid in list(self._stopping):
+            log.warning("killing worker %d" % pid)
+            os.kill(pid, signal.SIGKILL)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, Florian Wesch <fw@dividuum.de>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+# 
+#     Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the
+#     distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+# IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Persistent store of access tokens, so bots don't have to authenticate
+# with username and password on every start.
+#
+# For every account (the login name) the store keeps access token,
+# client token and the selected profile in a json file readable only by
+# the owner. session() returns a usable Session for an account: a
+# stored token is validated and, if that fails, refreshed. Only if both
+# fail, the account authenticates with its password. sessions() does
+# that for many accounts concurrently.
+
+import os
+import logging
+
+import simplejson as json
+from requests.exceptions import RequestException
+
+from fastmc.auth import Session, SessionException
+
+log = logging.getLogger(__name__)
+
+def _concurrent_map(func, items, concurrency):
+    try:
+        from gevent.pool import Pool
+    except ImportError:
+        from multiprocessing.pool import ThreadPool as Pool
+    return Pool(concurrency).map(func, items)
+
+class TokenStore(object):
+    def __init__(self, path):
+        self._path = path
+        self._accounts = {}
+        if os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self._path, "rb") as f:
+            self._accounts = json.load(f)
+        log.debug("loaded %d tokens from %s" % (len(self._accounts), self._path))
+
+    def save(self):
+        tmp = "%s.%d.tmp" % (self._path, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, "wb") as f:
+            json.dump(self._accounts, f, indent=2, sort_keys=True)
+        os.rename(tmp, self._path)
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def __contains__(self, account):
+        return account in self._accounts
+
+    def get(self, account):
+        info = self._accounts.get(account)
+        if info is None:
+            return None
+        return Session.from_authinfo(
+            info['access_token'],
+            info['player_ign'],
+            info['uuid'],
+            info['client_token'],
+        )
+
+    def put(self, account, session):
+        self._accounts[account] = {
+            'access_token': session.access_token,
+            'client_token': session.client_token,
+            'player_ign': session.player_ign,
+            'uuid': session.uuid,
+        }
+
+    def remove(self, account):
+        self._accounts.pop(account, None)
+
+    def _session(self, account, password):
+        stored = self.get(account)
+        if stored is not None:
+            try:
+                if stored.validate():
+                    return stored
+                session = stored.refresh()
+                log.debug("refreshed token of %s" % account)
+                self.put(account, session)
+                return session
+            except (SessionException, RequestException), err:
+                # validate() doesn't wrap connection errors
+                log.debug("cannot reuse token of %s: %s" % (account, err))
+        client_token = stored.client_token if stored is not None else None
+        session = Session.from_credentials(account, password, client_token)
+        log.debug("authenticated %s" % account)
+        self.put(account, session)
+        return session
+
+    def session(self, account, password):
+        session = self._session(account, password)
+        self.save()
+        return session
+
+    def sessions(self, credentials, concurrency=16):
+        # credentials is a list of (account, password) pairs. Returns a
+        # dict of account -> Session and a dict of account -> exception
+        # for accounts that failed to log in.
+        def login((account, password)):
+            try:
+                return account, self._session(account, password), None
+            except (SessionException, RequestException), err:
+                log.warning("login of %s failed: %s" % (account, err))
+                return account, None, err
+
+        sessions, errors = {}, {}
+        for account, session, err in _concurrent_map(login, credentials, concurrency):
+            if err is None:
+                sessions[account] = session
+            else:
+                errors[account] = err
+        self.save()
+        return sessions, errors
@@ -1,12 +1,18 @@
+import os
 from setuptools import setup
 
+# Protocol modules generated by fastmc.aot are shipped if they exist
+packages = ['fastmc']
+if os.path.exists(os.path.join('fastmc', 'generated', '__init__.py')):
+    packages.append('fastmc.generated')
+
 setup(
     name = 'fastmc',
     version = '1.8.0-alpha1',
     description = 'Fast Minecraft Protocol Parser/Writer',
     author = 'Florian Wesch',
     author_email = 'fw@dividuum.de',
-    packages = ['fastmc'],
+    packages = packages,
     license = 'BSD2',
     install_requires = ['requests', 'pycrypto', 'simplejson'],
     zip_safe = True,